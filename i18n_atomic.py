@@ -0,0 +1,173 @@
+import os
+import filecmp
+import tempfile
+from pathlib import Path
+
+
+def unchanged(filename, content):
+    """
+    Return whether filename exists and already has the bytes content is
+    written as (see stage), line endings included.
+    """
+    data = content.encode()
+    try:
+        if os.path.getsize(filename) != len(data):
+            return False
+        with open(filename, "rb") as fstream:
+            return fstream.read() == data
+    except OSError:
+        return False
+
+
+def new_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def temp_file(filename):
+    """
+    Return the fd and the name of a new temp file next to filename, with
+    the mode of filename (or the default one if it does not exist yet).
+    """
+    path = Path(filename)
+    fd, tmpname = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        os.chmod(tmpname, path.stat().st_mode if path.exists() else new_mode())
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmpname)
+        raise
+    return fd, tmpname
+
+
+def stage(filename, content):
+    """
+    Write content to a temp file next to filename, flushed to disk, to be
+    renamed over it by commit, and return the pair (temp file, filename).
+    Return None, writing nothing, when filename already has this content.
+
+    A symlink is resolved first, so its target is the file replaced and the
+    link is kept. The batch commands stage in their workers, so the temp
+    files are flushed in parallel.
+    """
+    filename = os.path.realpath(filename)
+    if unchanged(filename, content):
+        return None
+    fd, tmpname = temp_file(filename)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+    return tmpname, filename
+
+
+def fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_dirs(paths):
+    if os.name != "posix":
+        return
+    for directory in {os.path.dirname(os.path.abspath(path)) for path in paths}:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def commit(staged):
+    """
+    Rename every temp file of staged (see stage) over its file and return
+    how many files were replaced.
+
+    The temp files are already on disk, so every directory is synced once
+    after the last rename and a crash leaves every file either old or new,
+    never half written.
+    """
+    staged = [pair for pair in staged if pair is not None]
+    if not staged:
+        return 0
+    done = 0
+    try:
+        for tmpname, filename in staged:
+            os.replace(tmpname, filename)
+            done += 1
+    except BaseException:
+        discard(staged[done:])
+        raise
+    sync_dirs(filename for _, filename in staged)
+    return len(staged)
+
+
+def discard(staged):
+    """Remove the temp files of staged that were not committed"""
+    for pair in staged:
+        if pair is not None and os.path.exists(pair[0]):
+            os.unlink(pair[0])
+
+
+def write_atomic(filename, content):
+    """
+    Replace filename with content through a temp file, only when content is
+    different from what filename has. Return whether it was written.
+    """
+    return commit([stage(filename, content)]) == 1
+
+
+class AtomicFile:
+    """
+    Temp file next to filename (the target of the link if it is a symlink),
+    opened for writing as a stream, that replaces filename when closed
+    unless both have the same bytes. It is removed if anything fails, so
+    filename is never left half written.
+
+    After closing it, written tells whether filename was replaced.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.realpath(filename)
+        self.written = False
+
+    def __enter__(self):
+        fd, self.tmpname = temp_file(self.filename)
+        self.file = os.fdopen(fd, "w", encoding="utf-8", newline="")
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.file.close()
+            if exc_type is None and not (
+                os.path.exists(self.filename)
+                and filecmp.cmp(self.tmpname, self.filename, shallow=False)
+            ):
+                fsync_file(self.tmpname)
+                self.written = commit([(self.tmpname, self.filename)]) == 1
+        finally:
+            if not self.written and os.path.exists(self.tmpname):
+                os.unlink(self.tmpname)
+        return False
+
+
+def commit_summaries(summaries):
+    """
+    Commit the files staged by the workers of a batch, kept as 'staged' in
+    their summaries, set 'written' in every summary and return how many
+    files were written.
+    """
+    staged = []
+    for summary in summaries:
+        pair = summary.pop("staged", None)
+        summary["written"] = summary.get("written", False) or pair is not None
+        if pair is not None:
+            staged.append(pair)
+    return commit(staged)
@@ -0,0 +1,392 @@
+import os
+import sys
+import json
+import time
+import click
+import random
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from colorama import Fore, Style
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+HERE = Path(__file__).resolve().parent
+DEFAULT_SIZES = ["10x20", "100x50", "1000x50"]
+WORDS = [
+    "author", "work", "topic", "venue", "publisher", "sponsor", "award",
+    "location", "organization", "series", "chemical", "disease", "gene",
+    "taxon", "software", "dataset", "event", "project", "language", "use"
+]
+REPEATED = ["Examples", "Notes", "References", "See also"]
+
+# Commands timed on every corpus, {file} is the first template and
+# {query} the first SPARQL query of the corpus.
+COMMANDS = {
+    "set_label show": ["i18n_set_label.py", "show", "{file}"],
+    "set_label overwrite": ["i18n_set_label.py", "overwrite", "{templates}", "--format", "quiet"],
+    "create_json severalfiles": [
+        "i18n_create_json.py", "severalfiles", "-p", "{templates}/*.html",
+        "-o", "en.json", "--no-cache"
+    ],
+    "create_json check_duplicates": [
+        "i18n_create_json.py", "check-duplicates", "--path", "{templates}/*.html",
+        "--no-cache"
+    ],
+    "check_text show": ["i18n_check_text.py", "show", "{file}"],
+    "check_text show --chunked": ["i18n_check_text.py", "show", "{file}", "--chunked"],
+    "setlang_sparql findreplace": ["i18n_setlang_sparql.py", "findreplace", "{query}"],
+    "setlang_sparql filterlang": ["i18n_setlang_sparql.py", "filterlang", "{query}"],
+}
+
+# Subcommands of i18n_cli.py whose startup (interpreter, imports and click
+# setup, measured with --help) must stay under STARTUP_BUDGET seconds.
+STARTUP_COMMANDS = {
+    "set-label show": ["set-label", "show"],
+    "set-label batch": ["set-label", "batch"],
+    "create-json severalfiles": ["create-json", "severalfiles"],
+    "create-json check-duplicates": ["create-json", "check-duplicates"],
+    "check-text show": ["check-text", "show"],
+    "sparql batch": ["sparql", "batch"],
+    "index update": ["index", "update"],
+    "engine pipeline": ["engine", "pipeline"],
+}
+STARTUP_BUDGET = 0.4
+HEAVY_MODULES = ["bs4", "tabulate", "sqlite3", "concurrent.futures", "pdb"]
+
+
+def parse_size(size):
+    files, headers = size.lower().split("x")
+    return int(files), int(headers)
+
+
+def make_template(rng, name, headers, dup_ratio):
+    lines = [
+        '{% extends "base.html" %}',
+        "",
+        "{% block page_content %}",
+        "",
+        f'<h1 id="h1">{name.replace("_", " ").title()}</h1>',
+        ""
+    ]
+    for i in range(headers):
+        if rng.random() < dup_ratio:
+            text = rng.choice(REPEATED)
+        else:
+            text = " ".join(rng.sample(WORDS, 2)).capitalize() + f" {i}"
+        level = rng.choice(["h2", "h3", "h4"])
+        kind = rng.random()
+        if kind < 0.4:
+            slug = text.lower().replace(" ", "-")
+            lines.append(f'<{level} id="{slug}-header">{text}</{level}>')
+        elif kind < 0.6:
+            lines.append(f'<{level} class="section">{text}</{level}>')
+        elif kind < 0.7:
+            lines.append(f'<{level} data-i18n="{name}-{i}">{text}</{level}>')
+        else:
+            lines.append(f"<{level}>{text}</{level}>")
+        lines.append("")
+        lines.append(f'<table class="table" id="{name}-{i}-table"></table>')
+        lines.append(f"<p>\n\n{rng.choice(WORDS).capitalize()} described by {{{{ q }}}} {i}</p>")
+        lines.append(f"<div>\n\nUntranslated {rng.choice(WORDS)} text {i}\n</div>")
+        lines.append("")
+    lines += ["{% endblock %}", ""]
+    return "\n".join(lines)
+
+
+def make_query(rng, name):
+    filters = "\n".join(
+        f'  OPTIONAL {{ ?item rdfs:label ?l{i} . FILTER(LANG(?l{i}) = "{rng.choice(["en", "de", "es"])}") }}'
+        for i in range(rng.randint(1, 3))
+    )
+    languages = rng.choice(['"en"', '"en,[AUTO_LANGUAGE]"', '"[AUTO_LANGUAGE],en"'])
+    return (
+        f"# {name}\n"
+        "SELECT ?item ?itemLabel WHERE {\n"
+        "  ?item wdt:P50 target: .\n"
+        f"{filters}\n"
+        f"  SERVICE wikibase:label {{ bd:serviceParam wikibase:language {languages} . }}\n"
+        "}\n"
+    )
+
+
+def generate_corpus(directory, files, headers, dup_ratio=0.1, sparql_density=1, seed=0):
+    """
+    Write a synthetic corpus in directory and return its paths.
+
+    The corpus has files templates in templates/ with headers headers each
+    (dup_ratio of them with a repeated text), sparql_density queries per
+    template in queries/ and an empty static/i18n/en.json.
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    templates = directory / "templates"
+    queries = directory / "queries"
+    locales = directory / "static" / "i18n"
+    for path in (templates, queries, locales):
+        path.mkdir(parents=True, exist_ok=True)
+
+    for i in range(files):
+        name = f"{rng.choice(WORDS)}_{i}"
+        (templates / f"{name}.html").write_text(make_template(rng, name, headers, dup_ratio))
+        for j in range(sparql_density):
+            (queries / f"{name}_{j}.sparql").write_text(make_query(rng, f"{name}_{j}"))
+    (locales / "en.json").write_text(json.dumps({"@metadata": {"authors": []}}, indent=4))
+
+    return {
+        "templates": str(templates),
+        "file": str(min(templates.glob("*.html"))),
+        "query": str(min(queries.glob("*.sparql"), default="")),
+    }
+
+
+def measure(args):
+    """
+    Run args in a new process and return its wall time (s) and peak memory
+    (KiB), taken from the resource usage of that process only.
+
+    Its stderr goes to a temp file, as nothing reads a pipe while waiting
+    for the process and a full pipe would block it.
+    """
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr.seek(0)
+        error = stderr.read().decode("utf-8", "replace")
+    maxrss = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    return wall, maxrss, process.returncode, error
+
+
+def run_benchmarks(sizes, repeat, commands, dup_ratio, sparql_density, seed):
+    results = []
+    for size in sizes:
+        files, headers = parse_size(size)
+        with tempfile.TemporaryDirectory(prefix="i18n-bench-") as directory:
+            paths = generate_corpus(directory, files, headers, dup_ratio, sparql_density, seed)
+            for name in commands:
+                args = [sys.executable] + [
+                    str(HERE / arg) if arg.endswith(".py") else arg.format(**paths)
+                    for arg in COMMANDS[name]
+                ]
+                runs = [measure(args) for _ in range(repeat)]
+                walls = sorted(run[0] for run in runs)
+                result = {
+                    "size": size,
+                    "files": files,
+                    "headers": headers,
+                    "command": name,
+                    "wall": walls[len(walls) // 2],
+                    "walls": walls,
+                    "maxrss_kb": max(run[1] for run in runs),
+                    "returncode": runs[-1][2]
+                }
+                if runs[-1][2]:
+                    result["error"] = runs[-1][3].strip().splitlines()[-1:]
+                results.append(result)
+                click.echo(
+                    f"{size:>10s}  {name:<30s} {result['wall']:8.3f}s "
+                    f"{result['maxrss_kb'] / 1024:8.1f} MiB"
+                )
+    return results
+
+
+def imported_modules(args):
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", *args[1:]],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    return {
+        line.rsplit("|", 1)[-1].strip()
+        for line in process.stderr.splitlines() if line.startswith("import time:")
+    }
+
+
+def run_startup(commands, repeat, budget):
+    """
+    Return the startup time of every subcommand of i18n_cli.py and the
+    heavy modules it imports before running anything.
+    """
+    results = []
+    for name in commands:
+        args = [sys.executable, str(HERE / "i18n_cli.py"), *STARTUP_COMMANDS[name], "--help"]
+        walls = sorted(measure(args)[0] for _ in range(repeat))
+        modules = imported_modules(args)
+        result = {
+            "command": name,
+            "wall": walls[len(walls) // 2],
+            "walls": walls,
+            "budget": budget,
+            "heavy_imports": [module for module in HEAVY_MODULES if module in modules]
+        }
+        results.append(result)
+        click.echo(
+            f"{name:<30s} {result['wall']:8.3f}s  "
+            f"{'OVER BUDGET' if result['wall'] > budget else 'ok':<12s}"
+            f"{', '.join(result['heavy_imports'])}"
+        )
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('directory')
+@click.option('--files', '-n', type=int, default=100, show_default=True, help="number of templates")
+@click.option('--headers', type=int, default=50, show_default=True, help="headers per template")
+@click.option('--dup-ratio', type=float, default=0.1, show_default=True, help="ratio of headers with a repeated text")
+@click.option('--sparql-density', type=int, default=1, show_default=True, help="SPARQL queries per template")
+@click.option('--seed', type=int, default=0, show_default=True)
+def generate(directory, **kwargs):
+    """
+    To generate a synthetic corpus of templates and SPARQL queries
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_benchmark.py generate /tmp/corpus -n 500 --headers 80 --dup-ratio 0.2
+
+    """
+    generate_corpus(directory, kwargs["files"], kwargs["headers"],
+                    kwargs["dup_ratio"], kwargs["sparql_density"], kwargs["seed"])
+
+
+@cli.command()
+@click.option('--size', '-s', 'sizes', multiple=True, default=DEFAULT_SIZES, show_default=True,
+              help="corpus size as <files>x<headers per file>, can be repeated")
+@click.option('--command', '-c', 'commands', multiple=True, type=click.Choice(list(COMMANDS)),
+              help="command to time, can be repeated (all by default)")
+@click.option('--repeat', '-r', type=int, default=3, show_default=True, help="runs per command, the median is kept")
+@click.option('--dup-ratio', type=float, default=0.1, show_default=True, help="ratio of headers with a repeated text")
+@click.option('--sparql-density', type=int, default=1, show_default=True, help="SPARQL queries per template")
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('--output', '-o', default="bench_results.json", show_default=True, help="json file with the results")
+def run(**kwargs):
+    """
+    To time every command on synthetic corpora of several sizes
+
+    Every command runs in its own process on a freshly generated corpus, its
+    wall time (median of --repeat runs) and peak memory are written to the
+    json file given in --output, which can be compared with 'compare'.
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_benchmark.py run -s 100x50 -s 2000x50 -o before.json
+
+    """
+    results = run_benchmarks(
+        kwargs["sizes"], kwargs["repeat"], kwargs["commands"] or list(COMMANDS),
+        kwargs["dup_ratio"], kwargs["sparql_density"], kwargs["seed"]
+    )
+    with open(kwargs["output"], "w") as f:
+        json.dump({
+            "meta": {
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": kwargs["repeat"],
+                "dup_ratio": kwargs["dup_ratio"],
+                "sparql_density": kwargs["sparql_density"],
+                "seed": kwargs["seed"]
+            },
+            "results": results
+        }, f, indent=4)
+
+
+@cli.command()
+@click.option('--command', '-c', 'commands', multiple=True, type=click.Choice(list(STARTUP_COMMANDS)),
+              help="subcommand to time, can be repeated (all by default)")
+@click.option('--repeat', '-r', type=int, default=5, show_default=True, help="runs per subcommand, the median is kept")
+@click.option('--budget', '-b', type=float, default=STARTUP_BUDGET, show_default=True, help="maximum startup time in seconds")
+@click.option('--output', '-o', help="json file with the results")
+@click.pass_context
+def startup(ctx, **kwargs):
+    """
+    To time the startup of every subcommand of i18n_cli.py
+
+    Every subcommand runs with --help, so only the interpreter, the imports
+    and click are timed. The heavy modules (bs4, tabulate, sqlite3, ...)
+    imported before the command runs are listed, and the command exits with
+    status 1 when some subcommand is over --budget.
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_benchmark.py startup -b 0.3
+
+    """
+    results = run_startup(
+        kwargs["commands"] or list(STARTUP_COMMANDS), kwargs["repeat"], kwargs["budget"]
+    )
+    if kwargs["output"]:
+        with open(kwargs["output"], "w") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=4)
+    if any(result["wall"] > kwargs["budget"] for result in results):
+        ctx.exit(1)
+
+
+@cli.command()
+@click.argument('before')
+@click.argument('after')
+@click.option('--threshold', '-t', type=float, default=0.2, show_default=True,
+              help="relative slowdown or memory growth reported as regression")
+@click.pass_context
+def compare(ctx, before, after, threshold):
+    """
+    To compare two result files of 'run'
+
+    The command exits with status 1 when some command got slower, or used
+    more memory, by more than --threshold.
+    """
+    from tabulate import tabulate
+
+    with open(before) as f:
+        old = {(r["size"], r["command"]): r for r in json.load(f)["results"]}
+    with open(after) as f:
+        new = {(r["size"], r["command"]): r for r in json.load(f)["results"]}
+
+    rows = []
+    regressions = 0
+    for key in [key for key in new if key in old]:
+        wall = new[key]["wall"] / old[key]["wall"] if old[key]["wall"] else 1
+        rss = new[key]["maxrss_kb"] / old[key]["maxrss_kb"] if old[key]["maxrss_kb"] else 1
+        regression = wall > 1 + threshold or rss > 1 + threshold
+        regressions += regression
+        rows.append({
+            "size": key[0],
+            "command": key[1],
+            "wall before": f"{old[key]['wall']:.3f}",
+            "wall after": f"{new[key]['wall']:.3f}",
+            "wall x": f"{wall:.2f}",
+            "rss x": f"{rss:.2f}",
+            "": "REGRESSION" if regression else ""
+        })
+    print(Fore.LIGHTRED_EX if regressions else Fore.LIGHTGREEN_EX)
+    print(tabulate(rows, headers="keys", tablefmt="simple"))
+    print(Style.RESET_ALL)
+    if regressions:
+        ctx.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
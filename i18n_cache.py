@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+
+CACHE_FILE = ".i18n_cache.json"
+CACHE_MAX_ENTRIES = 50000
+CACHE_VERSION = 1
+
+
+def file_hash(filename):
+    digest = hashlib.sha1()
+    with open(filename, "rb") as fstream:
+        for chunk in iter(lambda: fstream.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class KeyCache:
+    """
+    On-disk manifest with the keys found in every template.
+
+    Every entry is indexed by the absolute path of the file and keeps its
+    mtime, size and content hash together with the keys of every kind of
+    extraction done on it. A file whose mtime and size did not change is
+    not read at all; a file whose hash did not change is not parsed again.
+    When the manifest grows over max_entries, the least recently used
+    entries are evicted on save.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.entries = {}
+        self.pending = {}
+        self.clock = 0
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get("version") == CACHE_VERSION:
+            self.entries = manifest.get("entries", {})
+            self.clock = max((entry["used"] for entry in self.entries.values()), default=0)
+
+    def save(self):
+        if not self.dirty:
+            return
+        if len(self.entries) > self.max_entries:
+            used = sorted(self.entries, key=lambda path: self.entries[path]["used"])
+            for path in used[:len(self.entries) - self.max_entries]:
+                del self.entries[path]
+        fd, tmpname = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, f)
+        os.replace(tmpname, self.path)
+        self.dirty = False
+
+    def touch(self, entry):
+        self.clock += 1
+        entry["used"] = self.clock
+        self.dirty = True
+
+    def lookup(self, filename, kind):
+        """
+        Return the cached keys of kind for filename or None if it must be
+        parsed again, in which case store must be called with its keys.
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(filename)
+        entry = self.entries.get(path)
+        if entry and (entry["mtime"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+            if kind in entry["keys"]:
+                self.touch(entry)
+                return entry["keys"][kind]
+        digest = file_hash(filename)
+        if entry and entry["hash"] == digest:
+            entry.update({"mtime": stat.st_mtime_ns, "size": stat.st_size})
+            self.touch(entry)
+            if kind in entry["keys"]:
+                return entry["keys"][kind]
+        else:
+            entry = {
+                "mtime": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "hash": digest,
+                "keys": {}
+            }
+        self.pending[(path, kind)] = entry
+        return None
+
+    def store(self, filename, kind, keys):
+        path = os.path.abspath(filename)
+        entry = self.pending.pop((path, kind))
+        entry["keys"][kind] = keys
+        self.entries[path] = entry
+        self.touch(entry)
+
+
+def cached_extract(files, extract_many, cache, kind):
+    """
+    Return the keys of every file, in the same order as files.
+
+    extract_many is only called with the files missing in the cache. When
+    cache is None every file is extracted.
+    """
+    if cache is None:
+        return extract_many(files)
+
+    results = [cache.lookup(file, kind) for file in files]
+    missing = [file for file, keys in zip(files, results) if keys is None]
+    extracted = iter(extract_many(missing))
+    for i, file in enumerate(files):
+        if results[i] is None:
+            results[i] = next(extracted)
+            cache.store(file, kind, results[i])
+    cache.save()
+    return results
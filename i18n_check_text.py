@@ -1,51 +1,187 @@
 import click
 import re
-from bs4 import BeautifulSoup
 from pathlib import Path
-from tabulate import tabulate
 from colorama import Fore, Style
-import itertools as it
+from collections import deque
+from html.parser import HTMLParser
+from i18n_atomic import write_atomic
+from i18n_common import print_records
+from i18n_lexer import (
+    TOKEN_CACHE_FILE, tokenize, tokenize_files, token_cache, text_runs, literal_lines,
+    find_text, line_offsets
+)
+from i18n_profile import phase, profiled, profile_options
 
+FORMATS = ["table", "ndjson", "quiet"]
+CHUNK_SIZE = 64 * 1024
+CONTEXT_LINES = 3
+UNTRANSLATED_TEXT = r"[\n]{2}([(]*[\w ]+)"
 
+
+@profiled("read", 0)
 def read_file(filename):
     with open(filename, "r") as fstream:
         content = fstream.read()
-        fstream.seek(0, 0)
-        content_by_lines = fstream.readlines()
-    return content, content_by_lines
+    return content
 
 
+@profiled("write", 0)
 def write_file(filename, content):
-    with open(filename, "w") as f:
-        f.write(content)
+    return write_atomic(filename, content)
 
 
+@profiled("render")
 def show_table(datadict, color, fmt="pretty"):
+    from tabulate import tabulate
     print(color)
     print(tabulate(datadict, headers="keys", tablefmt=fmt))
     print(Style.RESET_ALL)
 
 
-def filter_text(regex, soup, content_by_lines):
-    all_texts = soup.find_all(text=re.compile(regex))
-    filtered_text = [
-        x.strip("\n").split("\n")
-        for x in all_texts
-        if not any(ch in x for ch in ["{{", "{%"])
-    ]
-    filtered_text = list(it.chain.from_iterable(filtered_text))  # flat the list
-    linenumbers = [
-        [
-            i for i, elm in enumerate(content_by_lines)
-            if text in elm
-        ]
+def get_context(content, offsets, line, size=CONTEXT_LINES):
+    start = offsets[max(line - 1 - size, 0)]
+    end = offsets[line - 1 + size] if line - 1 + size < len(offsets) else len(content)
+    return content[start:end]
+
+
+class TextParser(HTMLParser):
+    """
+    Incremental parser that only keeps the lines of the text nodes matching
+    regex, with their line and column (1-based), as find_text does.
+
+    HTMLParser may split a text node between two chunks, so its pieces are
+    joined until the next tag, comment or declaration. The content of script
+    and style elements is skipped.
+    """
+
+    def __init__(self, regex):
+        super().__init__()
+        self.regex = re.compile(regex)
+        self.found = []
+        self.data = []
+        self.start = None
+
+    def handle_data(self, data):
+        if self.cdata_elem is not None:
+            return
+        if not self.data:
+            self.start = self.getpos()
+        self.data.append(data)
+
+    def flush(self, *args):
+        if not self.data:
+            return
+        data = "".join(self.data)
+        self.data.clear()
+        line, column = self.start
+        for run in text_runs(tokenize(data)):
+            for start, end in literal_lines(data, run, self.regex):
+                newline = data.rfind("\n", 0, start)
+                self.found.append((data[start:end], (
+                    line + data.count("\n", 0, start),
+                    start - newline if newline != -1 else column + start + 1
+                )))
+
+    handle_starttag = handle_endtag = handle_startendtag = flush
+    handle_comment = handle_decl = handle_pi = unknown_decl = flush
+
+    def close(self):
+        super().close()
+        self.flush()
+
+
+class LineWindow:
+    """
+    Lines read from a stream, enough to give the context of a line (as
+    get_context) once the lines after it are read. The lines before the
+    context of the oldest line still needed are dropped by trim.
+    """
+
+    def __init__(self, size=CONTEXT_LINES):
+        self.size = size
+        self.lines = deque()
+        self.first = 1
+        self.partial = ""
+        self.closed = False
 
-        for text in filtered_text
-    ]
-    return filtered_text, linenumbers
+    def feed(self, chunk):
+        lines = (self.partial + chunk).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.append(f"{line}\n")
+
+    def append(self, line):
+        self.lines.append(line)
+
+    def trim(self, line):
+        """Forget the lines that are not in the context of line or after it"""
+        while self.lines and self.first < line - self.size:
+            self.lines.popleft()
+            self.first += 1
+
+    def close(self):
+        if self.partial:
+            self.append(self.partial)
+        self.closed = True
+
+    def context(self, line):
+        """Return the context of line, or None if it is not read yet"""
+        last = self.first + len(self.lines) - 1
+        if line + self.size - 1 > last and not self.closed:
+            return None
+        start = max(line - self.size, self.first)
+        end = min(line + self.size - 1, last)
+        return "".join(self.lines[i - self.first] for i in range(start, end + 1))
+
+
+def iter_text(filename, regex, context=False, chunk_size=CHUNK_SIZE):
+    """
+    Yield (text, (line, column), context) for every line of text matching
+    regex, reading filename by chunks.
+
+    Only the chunk being parsed and, with context, the lines from the
+    context of the oldest text not yet reported are kept in memory, so it
+    does not grow with the size of the file.
+    """
+    parser = TextParser(regex)
+    window = LineWindow() if context else None
+    pending = deque()
+
+    def ready():
+        while pending:
+            text, position = pending[0]
+            found = window.context(position[0]) if window else None
+            if window and found is None:
+                return
+            pending.popleft()
+            yield text, position, found
+
+    def oldest():
+        lines = [position[0] for _, position in pending]
+        if parser.data:
+            lines.append(parser.start[0])
+        return min(lines, default=parser.getpos()[0])
+
+    with open(filename, "r") as fstream:
+        for chunk in iter(lambda: fstream.read(chunk_size), ""):
+            if window:
+                window.feed(chunk)
+            with phase("parse", filename):
+                parser.feed(chunk)
+            pending.extend(parser.found)
+            parser.found.clear()
+            yield from ready()
+            if window:
+                window.trim(oldest())
+    parser.close()
+    pending.extend(parser.found)
+    if window:
+        window.close()
+    yield from ready()
 
 
 @click.group()
+@profile_options
 def cli():
     pass
 
@@ -55,26 +191,61 @@ def cli():
 @click.option('--show', is_flag=True)
 @click.option('--replace', is_flag=True)
 @click.option('--showcontext', is_flag=True)
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as a table, one json object per text, or nothing")
+@click.option('--chunked', is_flag=True, help="read the file by chunks, for files too big to be loaded")
+@click.option('--chunk-size', type=int, default=CHUNK_SIZE, show_default=True, help="bytes read at once with --chunked")
+@click.option('--cache-file', help=f"manifest where the tokens of the file are kept, e.g. {TOKEN_CACHE_FILE}")
 def show(**kwargs):
     filename = kwargs["filename"]
+    showcontext = kwargs["showcontext"]
+
+    if kwargs["chunked"]:
+        found = iter_text(filename, UNTRANSLATED_TEXT, showcontext, kwargs["chunk_size"])
+    else:
+        content = read_file(filename)
+        offsets = line_offsets(content)
 
-    content, content_by_lines = read_file(filename)
+        if kwargs["cache_file"]:
+            tokens = tokenize_files([filename], token_cache(kwargs["cache_file"]))[0]
+        else:
+            with phase("lex", filename):
+                tokens = tokenize(content)
+        with phase("filter", filename):
+            filtered_text, positions = find_text(
+                content, tokens, UNTRANSLATED_TEXT, offsets
+            )
+        found = (
+            (text, position,
+             get_context(content, offsets, position[0]) if showcontext and position else None)
+            for text, position in zip(filtered_text, positions)
+        )
 
-    soupini = BeautifulSoup(content, 'html.parser')
-    filtered_text, linenumbers = filter_text(
-        r"[\n]{2}([(]*[\w ]+)", soupini, content_by_lines
-    )
+    if kwargs["fmt"] == "ndjson":
+        print_records(
+            {
+                "file": filename,
+                "line": position[0] if position else None,
+                "column": position[1] if position else None,
+                "text": text,
+                **({"context": context} if showcontext else {})
+            }
+            for text, position, context in found
+        )
+        return
+    if kwargs["fmt"] == "quiet":
+        for _ in found:
+            pass
+        return
 
+    found = list(found)
     show_table({
-        "# line": linenumbers,
-        f"{Path(filename).name}: text filtered": filtered_text}, Fore.YELLOW)
+        "# line": [position[0] if position else "?" for _, position, _ in found],
+        "column": [position[1] if position else "?" for _, position, _ in found],
+        f"{Path(filename).name}: text filtered": [text for text, _, _ in found]}, Fore.YELLOW)
 
-    context = [
-        "".join(content_by_lines[line[0]-3:line[0]+3])
-        for line in linenumbers
-    ]
+    context = [context for _, position, context in found if position]
 
-    if kwargs["showcontext"]:
+    if showcontext:
         print(Fore.GREEN)
         print(f"+{'CONTEXT':-^98s}+")
         for text in context:
@@ -0,0 +1,103 @@
+import shlex
+import click
+import importlib
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+# Every subcommand is the click group of one script, imported only when it
+# is run, so a command never pays for the imports of the others.
+SUBCOMMANDS = {
+    "set-label": ("i18n_set_label", "insert and rewrite the data-i18n attributes of the headers"),
+    "create-json": ("i18n_create_json", "extract the data-i18n keys to the json files"),
+    "check-text": ("i18n_check_text", "find the text without data-i18n"),
+    "sparql": ("i18n_setlang_sparql", "set the language options of the SPARQL queries"),
+    "index": ("i18n_index", "query the sqlite index of keys and headers"),
+    "engine": ("i18n_engine", "label the templates and update the json files in one run"),
+    "lexer": ("i18n_lexer", "split the templates in html, Jinja and text tokens"),
+    "benchmark": ("i18n_benchmark", "time the commands on synthetic corpora"),
+}
+
+
+class LazyGroup(click.Group):
+    """
+    Group whose subcommands are the groups of the scripts, imported on
+    demand. The help only lists them, without importing any script.
+    """
+
+    def list_commands(self, ctx):
+        return sorted([*SUBCOMMANDS, *self.commands])
+
+    def get_command(self, ctx, name):
+        if name in self.commands:
+            return self.commands[name]
+        if name not in SUBCOMMANDS:
+            return None
+        module, _ = SUBCOMMANDS[name]
+        return importlib.import_module(module).cli
+
+    def format_commands(self, ctx, formatter):
+        rows = [(name, SUBCOMMANDS[name][1]) for name in SUBCOMMANDS]
+        rows += [(name, command.get_short_help_str()) for name, command in self.commands.items()]
+        with formatter.section("Commands"):
+            formatter.write_dl(sorted(rows))
+
+
+@click.group(cls=LazyGroup, context_settings=CONTEXT_SETTINGS)
+def cli():
+    """
+    To run all the i18n scripts from one command
+
+    HOW TO USE
+
+    ===========
+
+        $ i18n set-label batch path/to/templates --replace
+
+        $ i18n create-json check-duplicates --path "path/to/templates/*.html"
+
+    """
+
+
+@cli.command()
+@click.argument('commands', nargs=-1, required=True)
+@click.pass_context
+def run(ctx, commands):
+    """
+    To run several commands in the same process
+
+    Every argument is one command line of this script. The commands run one
+    after the other, even when one of them fails, and the exit status is
+    the highest of them, so a hook with several checks starts the
+    interpreter once.
+
+    HOW TO USE
+
+    ===========
+
+        $ i18n run "check-text show page.html --format quiet" "create-json check-duplicates --path 'templates/*.html'"
+
+    """
+    status = 0
+    for command in commands:
+        try:
+            code = cli.main(shlex.split(command), prog_name=ctx.find_root().info_name, standalone_mode=False)
+        except click.exceptions.Exit as error:
+            code = error.exit_code
+        except click.ClickException as error:
+            error.show()
+            code = error.exit_code
+        except click.Abort:
+            code = 1
+        except Exception as error:
+            click.echo(f"Error: {command}: {type(error).__name__}: {error}", err=True)
+            code = 1
+        status = max(status, code if isinstance(code, int) else 0)
+    ctx.exit(status)
+
+
+def main():
+    cli()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import sys
+import json
+import glob
+from pathlib import Path
+from i18n_profile import profiled
+
+
+def expand_paths(paths, suffix=".html"):
+    """
+    Return the files of paths, each one once: the files ending with suffix
+    under every directory and the files matching every other path as a
+    glob (recursive with '**').
+    """
+    files = []
+    for path in paths:
+        if Path(path).is_dir():
+            files.extend(sorted(str(file) for file in Path(path).rglob(f"*{suffix}")))
+        else:
+            files.extend(sorted(glob.glob(path, recursive=True)))
+    return list(dict.fromkeys(files))
+
+
+@profiled("render")
+def print_records(records):
+    write = sys.stdout.write
+    for record in records:
+        write(json.dumps(record) + "\n")
@@ -1,44 +1,234 @@
+import os
+import sys
 import json
 import click
 import re
+import html
 import glob
-import subprocess
+import time
+import itertools
 from pathlib import Path
-from bs4 import BeautifulSoup
-from tabulate import tabulate
 from colorama import Fore, Style
-from collections import OrderedDict,Counter
-import pdb
-
-
+from collections import OrderedDict,defaultdict
+from functools import partial
+from html.parser import HTMLParser
+from i18n_atomic import AtomicFile, write_atomic
+from i18n_cache import CACHE_FILE, KeyCache, cached_extract
+from i18n_common import print_records
+from i18n_lexer import tokenize, start_tags, datai18n_value
+from i18n_profile import phase, profiled, profile_options, run_pool
+
+CHUNK_SIZE = 64 * 1024
+DATAI18N_BYTES_RX = re.compile(rb'(data-i18n\b=\"([^"]*)\")')
+DATAI18N_START_RX = re.compile(rb'data-i18n(?:=(?:"[^"]*)?)?\Z')
+UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+WHITESPACE_RX = re.compile(r"[ \t\n\r]*")
+FORMATS = ["table", "ndjson", "quiet"]
+
+
+@profiled("read", 0)
 def read_file(filename):
     with open(filename, "r") as fstream:
         content = fstream.read()
     return content
 
 
+@profiled("write", 0)
 def write_file(filename, content):
-    with open(filename, "w") as f:
-        f.write(content)
+    return write_atomic(filename, content)
 
 
+@profiled("read", 0)
 def read_json(filename):
     with open(filename, "r") as f:
         content = json.loads(f.read())
     return content
 
 
+@profiled("write", 0)
 def write_json(filename, data):
-    with open(filename, "w") as f:
-        f.write(json.dumps(data, indent=4))
+    """
+    Write data to filename through a temp file, only when its json is not
+    already the content of filename. Return whether it was written.
+    """
+    return write_atomic(filename, json.dumps(data, indent=4))
+
+
+def iter_json_items(filename):
+    """
+    Yield the (key, value) pairs of the json object of filename reading it
+    by chunks, so only one value at a time is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(filename, "r") as fstream:
+        buffer, pos, eof = "", 0, False
+
+        def more():
+            nonlocal buffer, pos, eof
+            chunk = fstream.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            return not eof
+
+        def skip(expected=None):
+            nonlocal pos
+            while True:
+                pos = WHITESPACE_RX.match(buffer, pos).end()
+                if pos < len(buffer) or not more():
+                    break
+            char = buffer[pos:pos + 1]
+            if expected is not None:
+                if char not in expected:
+                    raise ValueError(f"{filename}: expected {expected!r} at {char!r}")
+                pos += 1
+            return char
+
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if not more():
+                        raise
+                    continue
+                # a number may continue in the next chunk
+                if end == len(buffer) and more():
+                    continue
+                pos = end
+                return value
+
+        skip("{")
+        if skip() == "}":
+            return
+        while True:
+            key = decode()
+            skip(":")
+            skip()
+            yield key, decode()
+            if skip(",}") == "}":
+                return
+            skip()
+
+
+def dump_item(key, value):
+    return f"    {json.dumps(key)}: " + json.dumps(value, indent=4).replace("\n", "\n    ")
+
+
+@profiled("write", 0)
+def merge_locale(outfile, keys):
+    """
+    Add keys to the locale file outfile as a stream and return the keys it
+    already had and whether outfile was written.
+
+    The existing entries are read one by one and the sorted new keys are
+    merged between them, writing the result through a temp file renamed
+    over outfile (unless it has the same content), with '@metadata' first
+    and the same format as write_json. Return None as keys, leaving outfile
+    untouched, when its entries are not sorted; the caller then has to load
+    and sort it.
+    """
+    newkeys = sorted(set(keys))
+    existing = []
+    i = 0
+    items = iter_json_items(outfile) if outfile.exists() else iter(())
+
+    class Unsorted(Exception):
+        pass
+
+    writer = AtomicFile(outfile)
+    try:
+        with writer as f:
+            f.write("{")
+            first = next(items, ("@metadata", None))
+            if first[0] != "@metadata":
+                items = itertools.chain([first], items)
+                first = ("@metadata", None)
+            f.write("\n" + dump_item(*first))
+
+            previous = None
+            for key, value in items:
+                if key == "@metadata" or (previous is not None and key <= previous):
+                    raise Unsorted
+                previous = key
+                existing.append(key)
+                while i < len(newkeys) and newkeys[i] < key:
+                    f.write(",\n" + dump_item(newkeys[i], ""))
+                    i += 1
+                if i < len(newkeys) and newkeys[i] == key:
+                    i += 1
+                    value = value or ""
+                f.write(",\n" + dump_item(key, value))
+            for key in newkeys[i:]:
+                f.write(",\n" + dump_item(key, ""))
+            f.write("\n}")
+    except Unsorted:
+        return None, False
+    return existing, writer.written
+
+
+def save_locale(outfile, files, keys_by_file, kwargs):
+    """
+    Add the keys to outfile (or show the result without --inplace) and,
+    with --format ndjson, write one record per key added. Return whether
+    outfile was written: it is left untouched when nothing changes.
+    """
+    fmt = kwargs["format"]
+    verbose = kwargs["verbose"] and fmt == "table"
+    if kwargs["inplace"] and not verbose:
+        keys = set(itertools.chain.from_iterable(keys_by_file))
+        existing, written = merge_locale(outfile, keys)
+        if existing is not None:
+            if fmt == "ndjson":
+                print_records({"file": str(outfile), "key": key} for key in sorted(keys.difference(existing)))
+            elif fmt == "table" and not written:
+                print_unchanged(outfile)
+            return written
+
+    trfile_content = {}
+    if outfile.exists():
+        trfile_content = read_json(outfile)
+
+    metadata = {"@metadata":trfile_content.pop("@metadata",None)}
+    oldfields = set(trfile_content)
+    for file, keys in zip(files, keys_by_file):
+        merge_keys(file, keys, trfile_content, verbose)
+    
+    trfile_content = {**metadata,**OrderedDict(sorted(trfile_content.items()))}
+    
+    if fmt == "ndjson":
+        print_records(
+            {"file": str(outfile), "key": key}
+            for key in trfile_content if key != "@metadata" and key not in oldfields
+        )
+    if not kwargs["inplace"]:
+        if fmt == "table":
+            print_info(
+                trfile_content,
+                Fore.LIGHTGREEN_EX,
+                title=f"New content for {kwargs['output']}"
+            )
+        return False
+    written = write_json(outfile, trfile_content)
+    if fmt == "table" and not written:
+        print_unchanged(outfile)
+    return written
 
 
+@profiled("render")
+def print_unchanged(outfile):
+    print(f"{Fore.LIGHTYELLOW_EX}{outfile}: nothing changed, not written{Style.RESET_ALL}")
+
+
+@profiled("render")
 def show_table(datadict, color, fmt="pretty"):
+    from tabulate import tabulate
     print(color)
     print(tabulate(datadict, headers="keys", tablefmt=fmt))
     print(Style.RESET_ALL)
 
 
+@profiled("render")
 def print_info(datadict, color, title=''):
     print(color)
     print(f"+{title:-^60s}+")
@@ -47,15 +237,76 @@ def print_info(datadict, color, title=''):
     print(Style.RESET_ALL)
 
 
-def create_json_i18n(filename,json_content,verbose=False):
+class DataI18nParser(HTMLParser):
+    """
+    Incremental parser that only keeps the data-i18n values and their lines.
+
+    No tree is built, so feeding a file by chunks keeps the memory flat
+    whatever the size of the file.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.found = []
+
+    def handle_starttag(self, tag, attrs):
+        value = None
+        for name, attr_value in attrs:
+            if name == "data-i18n":
+                value = attr_value or ""
+        if value is not None:
+            self.found.append((value, self.getpos()[0]))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+
+def stream_extractor(filename):
+    parser = DataI18nParser()
+    with open(filename, "r") as fstream:
+        for chunk in iter(lambda: fstream.read(CHUNK_SIZE), ""):
+            parser.feed(chunk)
+            yield from parser.found
+            parser.found.clear()
+    parser.close()
+    yield from parser.found
+
+
+def bs4_extractor(filename):
+    from bs4 import BeautifulSoup
     content = read_file(filename)
     soup = BeautifulSoup(content, 'html.parser')
-    matches = soup.find_all([], {"data-i18n": True})
+    for tag in soup.find_all(True, {"data-i18n": True}):
+        yield tag.get("data-i18n"), tag.sourceline
+
+
+def lexer_extractor(filename):
+    content = read_file(filename)
+    line, last = 1, 0
+    for _, start, end in start_tags(content, tokenize(content)):
+        attr, group = datai18n_value(content, start, end)
+        if attr is None:
+            continue
+        line += content.count("\n", last, start)
+        last = start
+        yield html.unescape(attr.group(group)) if group else "", line
+
+
+EXTRACTORS = {"stream": stream_extractor, "bs4": bs4_extractor, "lexer": lexer_extractor}
+
+
+@profiled("parse", 0)
+def extract_keys(filename, backend="stream"):
+    return [key for key, line in EXTRACTORS[backend](filename)]
+
+
+@profiled("merge", 0)
+def merge_keys(filename, keys, json_content, verbose=False):
     oldfields = set(json_content)
 
-    for tag in matches:
-        if not json_content.get(tag.get("data-i18n"), None):
-            json_content.update({f"{tag.get('data-i18n')}": ''})
+    for key in keys:
+        if not json_content.get(key, None):
+            json_content.update({f"{key}": ''})
     
     newfields = {
         key
@@ -67,13 +318,98 @@ def create_json_i18n(filename,json_content,verbose=False):
             "existing fields": oldfields,
             "new fields": newfields
         }, Fore.YELLOW)
-        
+
+
+def create_json_i18n(filename,json_content,verbose=False,backend="stream"):
+    merge_keys(filename, extract_keys(filename, backend), json_content, verbose)
+
+
+def extract_all_keys(files, jobs=None, backend="stream", cache=None, index=None):
+    """
+    Return the keys of every file, in the same order as files.
+
+    The files missing in the cache (kept apart for every backend, as they
+    do not find the same keys in broken html) are parsed in a pool of
+    worker processes, each one returning only the list of keys, so merging
+    them afterwards gives the same result as parsing the files one after
+    the other. When index is the path of a sqlite index, the keys are kept
+    there instead, only the files changed since the backend extracted them
+    being parsed again.
+    """
+    extract_many = partial(run_pool, partial(extract_keys, backend=backend), jobs=jobs)
+    if index:
+        from i18n_index import KeyIndex
+        with KeyIndex(index) as key_index:
+            with phase("index"):
+                key_index.update(files)
+            return key_index.keys_by_file(files, backend, extract_many)
+    return cached_extract(files, extract_many, cache, f"data-i18n:{backend}")
+
+
+def count_chars(data):
+    return len(data.translate(None, UTF8_CONTINUATION))
+
+
+@profiled("scan", 0)
+def locate_keys(filename, chunk_size=CHUNK_SIZE):
+    """
+    Return [key, line, column] for every data-i18n attribute of filename.
+
+    The file is scanned once by chunks, counting the lines and columns of
+    the bytes between two matches, so it is never loaded as a whole: only
+    the chunk and the start of an attribute cut by its end are kept.
+    """
+    found = []
+    line, column = 1, 0
+    buffer = b""
+
+    def advance(data):
+        nonlocal line, column
+        newlines = data.count(b"\n")
+        if newlines:
+            line += newlines
+            column = count_chars(data[data.rfind(b"\n") + 1:])
+        else:
+            column += count_chars(data)
+
+    with open(filename, "rb") as fstream:
+        while True:
+            chunk = fstream.read(chunk_size)
+            buffer += chunk
+            last = 0
+            for match in DATAI18N_BYTES_RX.finditer(buffer):
+                advance(buffer[last:match.start()])
+                found.append([match.group(2).decode("utf-8", "replace"), line, column + 1])
+                advance(match.group(0))
+                last = match.end()
+            if not chunk:
+                break
+            start = DATAI18N_START_RX.search(buffer, last)
+            keep = start.start() if start else max(last, len(buffer) - len(b"data-i18n"))
+            advance(buffer[last:keep])
+            buffer = buffer[keep:]
+    return found
+
+
+def open_cache(kwargs):
+    if kwargs["no_cache"]:
+        return None
+    return KeyCache(kwargs["cache_file"])
+
+
+def cache_options(command):
+    command = click.option('--no-cache', is_flag=True, help="parse every file ignoring the cache")(command)
+    command = click.option('--cache-file', default=CACHE_FILE, show_default=True, help="manifest with the keys of every file")(command)
+    command = click.option('--index', help="sqlite index (see i18n_index.py) to query instead of parsing")(command)
+    return command
+
 
 def normalize(name):
     return name.replace("_", "-")
 
 
 @click.group(context_settings={"token_normalize_func": normalize})
+@profile_options
 def cli():
     pass
 
@@ -83,29 +419,21 @@ def cli():
 @click.option('--output', '-o')
 @click.option('-i', "--inplace", is_flag=True)
 @click.option('-v',"--verbose",is_flag=True)
+@click.option('-b', "--backend", type=click.Choice(list(EXTRACTORS)), default="stream", help="extractor used to find the data-i18n attributes")
+@click.option('--format', type=click.Choice(FORMATS), default="table", help="show the json content, one json object per key added, or nothing")
+@cache_options
 def onefile(**kwargs):
     filename = kwargs['file']
-    trfile_content = {}
-    verbose = kwargs["verbose"]
 
     outfile = Path(filename).parent.parent / "static/i18n" / kwargs['output']
 
-    if outfile.exists():
-        trfile_content = read_json(outfile)
-
-    metadata = {"@metadata":trfile_content.pop("@metadata",None)}
-    create_json_i18n(filename, trfile_content, verbose)
-    trfile_content = {**metadata,**OrderedDict(sorted(trfile_content.items()))}
-    
-    if not kwargs["inplace"]:        
-        print_info(
-            trfile_content,
-            Fore.LIGHTGREEN_EX,
-            title=f"New content for {kwargs['output']}"
-        )
-    else:
-        write_json(outfile, trfile_content)
-
+    keys_by_file = extract_all_keys(
+        [filename],
+        backend=kwargs["backend"],
+        cache=open_cache(kwargs),
+        index=kwargs["index"]
+    )
+    save_locale(outfile, [filename], keys_by_file, kwargs)
 
 
 @cli.command()
@@ -113,53 +441,426 @@ def onefile(**kwargs):
 @click.option('--output', '-o')
 @click.option('-i', "--inplace", is_flag=True)
 @click.option('-v',"--verbose",is_flag=True)
+@click.option('-j', "--jobs", type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.option('-b', "--backend", type=click.Choice(list(EXTRACTORS)), default="stream", help="extractor used to find the data-i18n attributes")
+@click.option('--format', type=click.Choice(FORMATS), default="table", help="show the json content, one json object per key added, or nothing")
+@cache_options
 def severalfiles(**kwargs):
     pattern = kwargs['pattern']
-    verbose = kwargs["verbose"]
 
-    trfile_content = {}
     outfile = Path(pattern).parent.parent / "static/i18n" / kwargs['output']
 
-    if outfile.exists():
-        trfile_content = read_json(outfile)
+    files = glob.glob(pattern)
+    keys_by_file = extract_all_keys(
+        files, kwargs["jobs"], kwargs["backend"], open_cache(kwargs), kwargs["index"]
+    )
+    save_locale(outfile, files, keys_by_file, kwargs)
 
+
+def snapshot(pattern):
+    files = {}
+    for file in glob.glob(pattern):
+        try:
+            stat = os.stat(file)
+        except OSError:
+            continue
+        files[file] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def update_locale(outfile, keys):
+    """
+    Add the missing keys to the locale file and return the keys added.
+
+    The locale file is read again on every call, so the translations edited
+    meanwhile are kept, and it is only written when some key is missing.
+    """
+    trfile_content = read_json(outfile) if outfile.exists() else {}
     metadata = {"@metadata":trfile_content.pop("@metadata",None)}
+    newfields = sorted({key for key in keys if key not in trfile_content})
+    if newfields:
+        trfile_content.update((key, '') for key in newfields)
+        trfile_content = {**metadata,**OrderedDict(sorted(trfile_content.items()))}
+        write_json(outfile, trfile_content)
+    return newfields
+
+
+@cli.command()
+@click.option('-p',"--pattern", required=True)
+@click.option('--output', '-o', required=True)
+@click.option('-b', "--backend", type=click.Choice(list(EXTRACTORS)), default="stream", help="extractor used to find the data-i18n attributes")
+@click.option('-n', "--interval", type=float, default=0.5, show_default=True, help="seconds between two checks of the templates")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report the keys added as text, one json object per update, or nothing")
+@cache_options
+def watch(**kwargs):
+    """
+    To keep the json file in sync while the templates are edited
+
+    This command does the same as 'severalfiles --inplace' and then keeps
+    polling the files of the pattern: only the files created or modified
+    since the last check are parsed again, and the json file is rewritten
+    only when they bring keys it does not have. Stop it with Ctrl+C.
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_create_json.py watch -p "path/to/templates/*.html" -o <lang>.json
+
+    """
+    pattern = kwargs['pattern']
+    outfile = Path(pattern).parent.parent / "static/i18n" / kwargs['output']
+    extract = partial(extract_keys, backend=kwargs["backend"])
+
+    seen = snapshot(pattern)
+    files = sorted(seen)
+    keys_by_file = extract_all_keys(
+        files,
+        backend=kwargs["backend"],
+        cache=open_cache(kwargs),
+        index=kwargs["index"]
+    )
+    changed_keys = [key for keys in keys_by_file for key in keys]
+
+    try:
+        while True:
+            newfields = update_locale(outfile, changed_keys) if changed_keys else []
+            if newfields and kwargs["fmt"] == "ndjson":
+                print_records([{
+                    "time": time.strftime('%H:%M:%S'), "file": str(outfile), "added": newfields
+                }])
+                sys.stdout.flush()
+            elif newfields and kwargs["fmt"] == "table":
+                print(f"{Fore.LIGHTGREEN_EX}{time.strftime('%H:%M:%S')} "
+                      f"{kwargs['output']}: added {', '.join(newfields)}{Style.RESET_ALL}")
+
+            time.sleep(kwargs["interval"])
+            current = snapshot(pattern)
+            changed_keys = []
+            for file, stat in list(current.items()):
+                if seen.get(file) != stat:
+                    try:
+                        changed_keys.extend(extract(file))
+                    except (OSError, ValueError):
+                        # being written or not valid text yet: retry at the next check
+                        if file in seen:
+                            current[file] = seen[file]
+                        else:
+                            del current[file]
+            seen = current
+    except KeyboardInterrupt:
+        pass
+
+
+def fan_out(localedir, keys, inplace=False, names=None):
+    """
+    Add keys to every locale file of localedir (or only to the ones named in
+    names) and return, for every one of them, the keys added, the stale
+    keys (keys of the file that are not in keys) and whether it was
+    written. Without inplace nothing is written, and the files that would
+    not change are never rewritten.
+    """
+    keys = set(keys)
+    results = []
+    if names:
+        outfiles = [Path(localedir) / name for name in names]
+    else:
+        outfiles = sorted(Path(localedir).glob("*.json"))
+    for outfile in outfiles:
+        existing, written = merge_locale(outfile, keys) if inplace else (None, False)
+        if existing is None:
+            existing = []
+            if outfile.exists():
+                existing = [key for key, _ in iter_json_items(outfile) if key != "@metadata"]
+            if inplace:
+                written = bool(update_locale(outfile, keys))
+        existing = set(existing)
+        results.append({
+            "language": outfile.stem,
+            "file": str(outfile),
+            "added": sorted(keys - existing),
+            "stale": sorted(existing - keys),
+            "written": written
+        })
+    return results
+
+
+@cli.command()
+@click.option('-p',"--pattern", required=True)
+@click.option('-l', "--locales", help="directory with the json files (default: static/i18n next to the templates)")
+@click.option('-i', "--inplace", is_flag=True)
+@click.option('-s', "--stale", is_flag=True, help="list the keys of every json file not used by the templates")
+@click.option('-j', "--jobs", type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.option('-b', "--backend", type=click.Choice(list(EXTRACTORS)), default="stream", help="extractor used to find the data-i18n attributes")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as tables, one json object per language, or nothing")
+@cache_options
+def all_locales(**kwargs):
+    """
+    To add the keys of the templates to every json file of static/i18n
+
+    The templates are parsed once and their keys are added, with an empty
+    value, to every json file of the directory, keeping its '@metadata'.
+    Without --inplace only the number of keys to add is shown.
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_create_json.py all-locales -p "path/to/templates/*.html" --inplace --stale
+
+    """
+    pattern = kwargs['pattern']
+    localedir = kwargs["locales"] or Path(pattern).parent.parent / "static/i18n"
+
     files = glob.glob(pattern)
-    for file in files:
-        create_json_i18n(file, trfile_content, verbose)
-    
-    trfile_content = {**metadata,**OrderedDict(sorted(trfile_content.items()))}
-    
-    if not kwargs["inplace"]:
-        print_info(
-            trfile_content,
-            Fore.LIGHTGREEN_EX,
-            title=f"New content for {kwargs['output']}"
+    keys_by_file = extract_all_keys(
+        files, kwargs["jobs"], kwargs["backend"], open_cache(kwargs), kwargs["index"]
+    )
+    results = fan_out(
+        localedir, itertools.chain.from_iterable(keys_by_file), kwargs["inplace"]
+    )
+
+    if kwargs["fmt"] == "ndjson":
+        print_records(
+            {**result, "stale": result["stale"] if kwargs["stale"] else len(result["stale"])}
+            for result in results
         )
-    else:
-        write_json(outfile, trfile_content)
+        return
+    if kwargs["fmt"] == "quiet":
+        return
+
+    rows = [
+        {
+            "LANGUAGE": result["language"],
+            "ADDED" if kwargs["inplace"] else "MISSING": len(result["added"]),
+            "STALE": len(result["stale"])
+        }
+        for result in results
+    ]
+    show_table(rows, color=Fore.LIGHTGREEN_EX, fmt="simple")
+    if kwargs["inplace"]:
+        written = sum(result["written"] for result in results)
+        print(f"{Fore.LIGHTCYAN_EX}{len(results)} json files: {written} written, "
+              f"{len(results) - written} skipped as unchanged{Style.RESET_ALL}")
+    if kwargs["stale"]:
+        for result in results:
+            if result["stale"]:
+                show_table(
+                    {f"STALE KEYS IN {result['language']}.json": result["stale"]},
+                    color=Fore.LIGHTYELLOW_EX,
+                    fmt="simple"
+                )
+
+
+def percent(part, total):
+    return round(100 * part / total, 2) if total else 100.0
+
+
+def locale_keys(outfile):
+    """
+    Return the keys of the locale file outfile and the ones with an empty
+    value, reading it as a stream.
+    """
+    keys, empty = set(), set()
+    for key, value in iter_json_items(outfile):
+        if key == "@metadata":
+            continue
+        keys.add(key)
+        if not value:
+            empty.add(key)
+    return keys, empty
+
+
+@profiled("coverage")
+def coverage_report(files, keys_by_file, localedir, languages=None, by_file=False):
+    """
+    Return the coverage of the keys of the templates by every locale file
+    of localedir (only the languages in languages if given).
+
+    For every language, the keys used in the templates are split with set
+    operations in translated, missing (no entry) and empty (empty value),
+    and the entries that no template uses are orphaned. With by_file, the
+    same counts are given for every template.
+    """
+    file_keys = [set(keys) for keys in keys_by_file]
+    used = set().union(*file_keys)
+    results = []
+    for outfile in sorted(Path(localedir).glob("*.json")):
+        if languages and outfile.stem not in languages:
+            continue
+        entries, empty = locale_keys(outfile)
+        missing = used - entries
+        empty &= used
+        translated = len(used) - len(missing) - len(empty)
+        result = {
+            "language": outfile.stem,
+            "file": str(outfile),
+            "keys": len(used),
+            "translated": translated,
+            "coverage": percent(translated, len(used)),
+            "missing": sorted(missing),
+            "empty": sorted(empty),
+            "orphaned": sorted(entries - used)
+        }
+        if by_file:
+            result["files"] = []
+            for file, keys in zip(files, file_keys):
+                file_missing = len(keys & missing)
+                file_empty = len(keys & empty)
+                result["files"].append({
+                    "file": file,
+                    "keys": len(keys),
+                    "missing": file_missing,
+                    "empty": file_empty,
+                    "coverage": percent(len(keys) - file_missing - file_empty, len(keys))
+                })
+        results.append(result)
+    return results
+
+
+@cli.command()
+@click.option('-p',"--pattern", required=True)
+@click.option('-l', "--locales", help="directory with the json files (default: static/i18n next to the templates)")
+@click.option('--lang', "languages", multiple=True, help="language to check, e.g. es, can be repeated (all by default)")
+@click.option('--by-file', is_flag=True, help="show the coverage of every template")
+@click.option('--list', "list_keys", is_flag=True, help="list the missing, empty and orphaned keys")
+@click.option('--fail-under', type=float, default=None, help="exit with status 1 when a language is under this percentage")
+@click.option('-j', "--jobs", type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.option('-b', "--backend", type=click.Choice(list(EXTRACTORS)), default="stream", help="extractor used to find the data-i18n attributes")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS + ["json"]), default="table", help="report as tables, one json object per language (ndjson) or for all of them, or nothing")
+@cache_options
+@click.pass_context
+def coverage(ctx, **kwargs):
+    """
+    To show how many keys of the templates every language translates
+
+    The templates are parsed once and every json file of static/i18n is
+    read once. For every language, the keys used in the templates without
+    entry (missing) or with an empty value (empty) and the entries no
+    template uses (orphaned) are counted.
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_create_json.py coverage -p "path/to/templates/*.html" --lang es --by-file --list
+
+    """
+    pattern = kwargs['pattern']
+    localedir = kwargs["locales"] or Path(pattern).parent.parent / "static/i18n"
+
+    files = glob.glob(pattern)
+    keys_by_file = extract_all_keys(
+        files, kwargs["jobs"], kwargs["backend"], open_cache(kwargs), kwargs["index"]
+    )
+    results = coverage_report(
+        files, keys_by_file, localedir, kwargs["languages"], kwargs["by_file"]
+    )
+
+    if kwargs["fmt"] == "json":
+        print(json.dumps(results, indent=4))
+    elif kwargs["fmt"] == "ndjson":
+        print_records(results)
+    elif kwargs["fmt"] == "table":
+        show_table(
+            [
+                {
+                    "LANGUAGE": result["language"],
+                    "KEYS": result["keys"],
+                    "TRANSLATED": result["translated"],
+                    "MISSING": len(result["missing"]),
+                    "EMPTY": len(result["empty"]),
+                    "ORPHANED": len(result["orphaned"]),
+                    "COVERAGE": f"{result['coverage']:.2f}%"
+                }
+                for result in results
+            ],
+            color=Fore.LIGHTGREEN_EX,
+            fmt="simple"
+        )
+        for result in results:
+            if kwargs["by_file"]:
+                show_table(
+                    [
+                        {
+                            f"FILE ({result['language']})": row["file"],
+                            "KEYS": row["keys"],
+                            "MISSING": row["missing"],
+                            "EMPTY": row["empty"],
+                            "COVERAGE": f"{row['coverage']:.2f}%"
+                        }
+                        for row in result["files"]
+                    ],
+                    color=Fore.LIGHTCYAN_EX,
+                    fmt="simple"
+                )
+            if kwargs["list_keys"]:
+                for kind in ("missing", "empty", "orphaned"):
+                    if result[kind]:
+                        show_table(
+                            {f"{kind.upper()} KEYS IN {result['language']}.json": result[kind]},
+                            color=Fore.LIGHTYELLOW_EX,
+                            fmt="simple"
+                        )
+
+    if kwargs["fail_under"] is not None and any(
+        result["coverage"] < kwargs["fail_under"] for result in results
+    ):
+        ctx.exit(1)
 
 
 @cli.command()
 @click.option('--path',required=True)
+@click.option('-j', "--jobs", type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.option('--format', "fmt", type=click.Choice(FORMATS + ["json"]), default="table", help="output format")
+@cache_options
 def check_duplicates(**kwargs):
+    """
+    To find the keys used more than once and where they are
+
+    Every location (file, line and column) of every duplicated key is shown.
+    With --format json/ndjson the result is written as a json object or as
+    one json object per duplicated key; with quiet nothing is written.
+    """
     path = kwargs["path"]
     files = glob.glob(path)
-    rx = re.compile(r'(data-i18n\b=\"([^"]*)\")')
-    content = []
-    for file in files:
-        string = read_file(file)
-        matches=rx.finditer(string)
-        for match in matches:
-            content.append(match.group(2))
-
-    duplicates = [key for key,val in Counter(content).items() if val>1]
-
-    show_table(
-        {"KEY DUPLICATES": duplicates if duplicates else ["There are not duplicated keys"]},
-        color=Fore.LIGHTRED_EX,
-        fmt="simple"
-    )
+    if kwargs["index"]:
+        from i18n_index import KeyIndex
+        with phase("index"), KeyIndex(kwargs["index"]) as key_index:
+            key_index.update(files)
+            locations_by_file = key_index.locations(files)
+    else:
+        locations_by_file = cached_extract(
+            files,
+            partial(run_pool, locate_keys, jobs=kwargs["jobs"]),
+            open_cache(kwargs),
+            "locations"
+        )
+
+    index = defaultdict(list)
+    for file, locations in zip(files, locations_by_file):
+        for key, line, column in locations:
+            index[key].append({"file": file, "line": line, "column": column})
+    duplicates = {key: found for key, found in index.items() if len(found) > 1}
+
+    if kwargs["fmt"] == "json":
+        print(json.dumps(duplicates, indent=4))
+    elif kwargs["fmt"] == "ndjson":
+        print_records({"key": key, "locations": found} for key, found in duplicates.items())
+    elif kwargs["fmt"] == "quiet":
+        pass
+    elif duplicates:
+        rows = [
+            {"KEY DUPLICATES": key, **{name.upper(): value for name, value in location.items()}}
+            for key, found in duplicates.items() for location in found
+        ]
+        show_table(rows, color=Fore.LIGHTRED_EX, fmt="simple")
+    else:
+        show_table(
+            {"KEY DUPLICATES": ["There are not duplicated keys"]},
+            color=Fore.LIGHTRED_EX,
+            fmt="simple"
+        )
 
 
 if __name__ == '__main__':
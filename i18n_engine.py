@@ -0,0 +1,253 @@
+import click
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import itemgetter
+from pathlib import Path
+from collections import defaultdict
+from functools import partial
+from colorama import Fore, Style
+from i18n_set_label import (
+    read_file, parse_headers, find_insertions, number_occurrences,
+    check_repeated, splice, tag_spans
+)
+from i18n_check_text import UNTRANSLATED_TEXT
+from i18n_lexer import tokenize, find_text, line_offsets
+from i18n_atomic import stage, commit_summaries
+from i18n_create_json import fan_out
+from i18n_common import expand_paths
+from i18n_profile import phase, profiled, profile_options, run_pool
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+
+def position(offsets, pos):
+    line = bisect_right(offsets, pos)
+    return {"line": line, "column": pos - offsets[line - 1] + 1}
+
+
+def shifter(insertions):
+    """
+    Return a function moving an offset of the template as read to the same
+    place of the template with the insertions done.
+    """
+    insertions = sorted(insertions, key=itemgetter(0))
+    starts = [offset for offset, _ in insertions]
+    shifts = [0, *accumulate(len(text) for _, text in insertions)]
+    return lambda pos: pos + shifts[bisect_left(starts, pos)]
+
+
+def analyze(filename, content=None, text_regex=UNTRANSLATED_TEXT, tokens=None):
+    """
+    Tokenize and parse the template filename once and return all that the
+    commands find in it, as plain data:
+
+    - headers: the headers (tag, id, text) that set_label looks at,
+    - insertions: the data-i18n attributes to insert, with the offset,
+      line and column of the template as read,
+    - keys: every data-i18n of the labelled template, in document order,
+      with 'new' telling whether it comes from an insertion,
+    - untranslated: the text found by check_text,
+    - new_content: the labelled template.
+
+    Except for the insertions, lines and columns are the ones of the
+    labelled template (inserting attributes never changes the lines). When
+    content is given, the file is not read, and when tokens are given (see
+    i18n_lexer.tokenize) it is not tokenized.
+    """
+    if content is None:
+        content = read_file(filename)
+    name = Path(filename).stem.replace("_","-").lower()
+    if tokens is None:
+        with phase("lex", filename):
+            tokens = tokenize(content)
+    soup = parse_headers(filename, content, tokens)
+
+    with phase("rewrite", filename):
+        offsets = line_offsets(content)
+        spans = tag_spans(content, tokens)
+        headers_with_id, headers_without_id, changes = find_insertions(
+            soup, content, offsets, name, spans
+        )
+        occurrences = number_occurrences(content, tokens, changes)
+        insertions = check_repeated(occurrences)
+        new_content = splice(content, insertions)
+        new_offsets = line_offsets(new_content) if insertions else offsets
+        moved = shifter(insertions)
+
+    with phase("filter", filename):
+        texts, positions = find_text(content, tokens, text_regex, offsets)
+
+    return {
+        "filename": filename,
+        "headers": [
+            {
+                "tag": tag.name,
+                "id": tag.get("id"),
+                "text": tag.text.strip(),
+                **position(new_offsets, moved(offsets[tag.sourceline - 1] + tag.sourcepos))
+            }
+            for tag in headers_with_id + headers_without_id
+        ],
+        "insertions": [
+            {"offset": offset, "text": text, **position(offsets, offset)}
+            for offset, text in sorted(insertions, key=itemgetter(0))
+        ],
+        "keys": [
+            {"key": f"{key}{suffix}", "new": change is not None, **position(new_offsets, moved(start))}
+            for start, key, suffix, offset, prefix, change in occurrences
+        ],
+        "untranslated": [
+            {
+                "text": text,
+                **(position(new_offsets, moved(offsets[found[0] - 1] + found[1] - 1))
+                   if found else {"line": None, "column": None})
+            }
+            for text, found in zip(texts, positions)
+        ],
+        "new_content": new_content,
+        "changed": new_content != content
+    }
+
+
+def find_duplicates(results):
+    """Return every key used more than once in results and where it is"""
+    index = defaultdict(list)
+    for result in results:
+        for key in result.get("keys", []):
+            index[key["key"]].append({
+                "file": result["filename"], "line": key["line"], "column": key["column"]
+            })
+    return {key: found for key, found in index.items() if len(found) > 1}
+
+
+def pipeline_file(filename, replace=False):
+    """
+    Analyze filename, stage the labelled template (see i18n_atomic.stage)
+    in result["staged"] when replace is set, and return the result without
+    its content, or only the filename and the exception as 'error' if it
+    failed.
+    """
+    try:
+        result = analyze(filename)
+        new_content = result.pop("new_content")
+        if replace and result["changed"]:
+            with phase("write", filename):
+                result["staged"] = stage(filename, new_content)
+    except Exception as error:
+        return {"filename": filename, "error": f"{type(error).__name__}: {error}"}
+    return result
+
+
+def run_pipeline(files, jobs=None, replace=False, localedir=None, names=None):
+    """
+    Label every template, then add the keys of the labelled templates to the
+    locale files of localedir (only the ones in names if given), reading and
+    parsing every template once.
+
+    Return the results of every file, the duplicated keys and the summary
+    of every locale file (see i18n_create_json.fan_out). Nothing is written
+    unless replace is set, and then only the files that change, all the
+    templates being renamed at once by the end of the batch.
+    """
+    results = run_pool(partial(pipeline_file, replace=replace), files, jobs)
+    commit_summaries(results)
+    keys = [key["key"] for result in results for key in result.get("keys", [])]
+    locales = fan_out(localedir, keys, replace, names) if localedir else []
+    return results, find_duplicates(results), locales
+
+
+@profiled("render")
+def show_table(datadict, color, fmt="simple"):
+    from tabulate import tabulate
+    print(color)
+    print(tabulate(datadict, headers="keys", tablefmt=fmt))
+    print(Style.RESET_ALL)
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+@profile_options
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--locales', '-l', help="directory with the json files (default: static/i18n next to the templates)")
+@click.option('--output', '-o', 'names', multiple=True, help="json file to update, can be repeated (all of them by default)")
+@click.option('--replace', is_flag=True, help="to write the templates and the json files")
+@click.option('--jobs', '-j', type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.pass_context
+def pipeline(ctx, **kwargs):
+    """
+    To label the templates and update the json files in one run
+
+    Every template is read and parsed once to insert the attributes
+    'data-i18n' (as 'i18n_set_label.py show'), collect its keys (as
+    'i18n_create_json.py all-locales'), find the duplicated keys and the
+    untranslated text (as 'i18n_check_text.py show').
+
+    HOW TO USE
+
+    ===========
+
+    1. For showing what would change:
+
+        $ python i18n_engine.py pipeline path/to/templates
+
+    2. For labelling the templates and updating en.json and es.json:
+
+        $ python i18n_engine.py pipeline path/to/templates -o en.json -o es.json --replace
+
+    """
+    files = expand_paths(kwargs["paths"])
+    localedir = kwargs["locales"]
+    if not localedir and files:
+        localedir = Path(files[0]).parent.parent / "static/i18n"
+
+    results, duplicates, locales = run_pipeline(
+        files, kwargs["jobs"], kwargs["replace"], localedir, kwargs["names"]
+    )
+
+    show_table({
+            "FILENAME": [result["filename"] for result in results],
+            "STATUS": [
+                "error" if "error" in result else "written" if result["written"]
+                else "changed" if result["changed"] else "unchanged"
+                for result in results
+            ],
+            "NEW LABELS": [len(result.get("insertions", [])) for result in results],
+            "KEYS": [len(result.get("keys", [])) for result in results],
+            "UNTRANSLATED": [len(result.get("untranslated", [])) for result in results],
+            "INFO": [result.get("error", "") for result in results]
+        },
+        Fore.LIGHTYELLOW_EX
+    )
+    if duplicates:
+        show_table(
+            [
+                {"KEY DUPLICATES": key, **{name.upper(): value for name, value in location.items()}}
+                for key, found in duplicates.items() for location in found
+            ],
+            Fore.LIGHTRED_EX
+        )
+    if locales:
+        show_table(
+            [
+                {
+                    "LANGUAGE": locale["language"],
+                    "ADDED" if kwargs["replace"] else "MISSING": len(locale["added"]),
+                    "STALE": len(locale["stale"]),
+                    **({"WRITTEN": locale["written"]} if kwargs["replace"] else {})
+                }
+                for locale in locales
+            ],
+            Fore.LIGHTGREEN_EX
+        )
+
+    errors = sum("error" in result for result in results)
+    if errors:
+        ctx.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
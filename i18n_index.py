@@ -0,0 +1,429 @@
+import os
+import json
+import click
+import sqlite3
+from pathlib import Path
+from html.parser import HTMLParser
+from colorama import Fore, Style
+from i18n_cache import file_hash
+from i18n_common import expand_paths
+from i18n_create_json import locate_keys
+from i18n_profile import profiled, profile_options
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+INDEX_FILE = ".i18n_index.sqlite"
+INDEX_VERSION = 1
+HEADERS = ["h1", "h2", "h3", "h4", "h5"]
+CHUNK_SIZE = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS keys (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    col INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS keys_key ON keys(key);
+CREATE INDEX IF NOT EXISTS keys_file ON keys(file_id);
+CREATE TABLE IF NOT EXISTS extracted (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    backend TEXT NOT NULL,
+    keys TEXT NOT NULL,
+    PRIMARY KEY (file_id, backend)
+);
+CREATE TABLE IF NOT EXISTS headers (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    id TEXT,
+    key TEXT
+);
+CREATE INDEX IF NOT EXISTS headers_file ON headers(file_id);
+CREATE TABLE IF NOT EXISTS locale_files (
+    path TEXT PRIMARY KEY,
+    lang TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS locale (
+    lang TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (lang, key)
+);
+"""
+
+
+class IndexParser(HTMLParser):
+    """
+    Incremental parser that keeps the headers of a template with their line
+    and column (1-based), their id and their data-i18n key.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.headers = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HEADERS:
+            attrs = dict(attrs)
+            line, column = self.getpos()
+            key = attrs.get("data-i18n", False)
+            self.headers.append((
+                tag, line, column + 1, attrs.get("id"), None if key is False else key or ""
+            ))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+
+@profiled("parse", 0)
+def parse_template(filename):
+    """
+    Return the keys of filename where locate_keys finds them, so the index
+    gives the same locations as scanning the file, and its headers.
+    """
+    parser = IndexParser()
+    with open(filename, "r") as fstream:
+        for chunk in iter(lambda: fstream.read(CHUNK_SIZE), ""):
+            parser.feed(chunk)
+    parser.close()
+    return locate_keys(filename), parser.headers
+
+
+class KeyIndex:
+    """
+    SQLite index of the keys and headers of the templates and of the
+    entries of the locale files.
+
+    update only parses the templates whose mtime and size changed and whose
+    content hash is different from the indexed one, so keeping the index
+    up to date costs one stat per template.
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+        version, = self.db.execute("PRAGMA user_version").fetchone()
+        if version != INDEX_VERSION:
+            with self.db:
+                self.db.execute("DELETE FROM files")
+                self.db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def update(self, files):
+        """
+        Index the templates of files that changed and return how many were
+        parsed. Templates that no longer exist are removed from the index.
+        """
+        indexed = {
+            path: (file_id, mtime, size, digest)
+            for file_id, path, mtime, size, digest
+            in self.db.execute("SELECT id, path, mtime, size, hash FROM files")
+        }
+        parsed = 0
+        with self.db:
+            for file in files:
+                path = os.path.abspath(file)
+                stat = os.stat(path)
+                row = indexed.get(path)
+                if row and row[1:3] == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                digest = file_hash(path)
+                if row and row[3] == digest:
+                    self.db.execute(
+                        "UPDATE files SET mtime = ?, size = ? WHERE id = ?",
+                        (stat.st_mtime_ns, stat.st_size, row[0])
+                    )
+                    continue
+                keys, headers = parse_template(path)
+                if row:
+                    self.db.execute("DELETE FROM files WHERE id = ?", (row[0],))
+                file_id = self.db.execute(
+                    "INSERT INTO files (path, mtime, size, hash) VALUES (?, ?, ?, ?)",
+                    (path, stat.st_mtime_ns, stat.st_size, digest)
+                ).lastrowid
+                self.db.executemany(
+                    "INSERT INTO keys (file_id, key, line, col) VALUES (?, ?, ?, ?)",
+                    [(file_id, *key) for key in keys]
+                )
+                self.db.executemany(
+                    "INSERT INTO headers (file_id, tag, line, col, id, key) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(file_id, *header) for header in headers]
+                )
+                parsed += 1
+            for path, (file_id, *_) in indexed.items():
+                if not os.path.exists(path):
+                    self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        return parsed
+
+    def update_locales(self, directory):
+        """
+        Index the entries of the json files of directory that changed and
+        return how many were loaded.
+        """
+        indexed = {
+            path: (mtime, size)
+            for path, mtime, size in self.db.execute(
+                "SELECT path, mtime, size FROM locale_files"
+            )
+        }
+        loaded = 0
+        with self.db:
+            for file in sorted(Path(directory).glob("*.json")):
+                path = str(file.resolve())
+                stat = file.stat()
+                if indexed.pop(path, None) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                with open(path, "r") as f:
+                    content = json.load(f)
+                content.pop("@metadata", None)
+                lang = file.stem
+                self.db.execute("DELETE FROM locale WHERE lang = ?", (lang,))
+                self.db.executemany(
+                    "INSERT INTO locale (lang, key, value) VALUES (?, ?, ?)",
+                    [(lang, key, value if isinstance(value, str) else json.dumps(value))
+                     for key, value in content.items()]
+                )
+                self.db.execute(
+                    "INSERT OR REPLACE INTO locale_files (path, lang, mtime, size) VALUES (?, ?, ?, ?)",
+                    (path, lang, stat.st_mtime_ns, stat.st_size)
+                )
+                loaded += 1
+            for path in indexed:
+                if os.path.exists(path):
+                    continue
+                lang, = self.db.execute(
+                    "SELECT lang FROM locale_files WHERE path = ?", (path,)
+                ).fetchone()
+                self.db.execute("DELETE FROM locale WHERE lang = ?", (lang,))
+                self.db.execute("DELETE FROM locale_files WHERE path = ?", (path,))
+        return loaded
+
+    def locations(self, files):
+        """
+        Return [key, line, column] for every data-i18n attribute of every
+        file, in the same order as files.
+        """
+        return [
+            [list(row) for row in self.db.execute(
+                "SELECT key, line, col FROM keys JOIN files ON files.id = keys.file_id "
+                "WHERE files.path = ? ORDER BY line, col",
+                (os.path.abspath(file),)
+            )]
+            for file in files
+        ]
+
+    def keys_by_file(self, files, backend, extract_many):
+        """
+        Return the keys the extractor backend finds in every file, in the
+        same order as files, which must be indexed (see update).
+
+        extract_many is only called with the files this backend did not
+        extract since they were indexed, and their keys are stored for the
+        next calls.
+        """
+        ids = [
+            self.db.execute(
+                "SELECT id FROM files WHERE path = ?", (os.path.abspath(file),)
+            ).fetchone()[0]
+            for file in files
+        ]
+        stored = dict(self.db.execute(
+            "SELECT file_id, keys FROM extracted WHERE backend = ?", (backend,)
+        ))
+        results = [json.loads(stored[file_id]) if file_id in stored else None for file_id in ids]
+        missing = [file for file, keys in zip(files, results) if keys is None]
+        extracted = iter(extract_many(missing))
+        with self.db:
+            for i, file_id in enumerate(ids):
+                if results[i] is None:
+                    results[i] = next(extracted)
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO extracted (file_id, backend, keys) VALUES (?, ?, ?)",
+                        (file_id, backend, json.dumps(results[i]))
+                    )
+        return results
+
+    def files_using(self, key):
+        return self.db.execute(
+            "SELECT files.path, line, col FROM keys "
+            "JOIN files ON files.id = keys.file_id WHERE key = ? "
+            "ORDER BY files.path, line, col",
+            (key,)
+        ).fetchall()
+
+    def duplicates(self):
+        return self.db.execute(
+            "SELECT key, COUNT(*) FROM keys GROUP BY key HAVING COUNT(*) > 1 ORDER BY key"
+        ).fetchall()
+
+    def missing(self, lang=None):
+        """
+        Return (lang, key) for every key used in the templates that has no
+        entry in the locale of lang (every indexed locale if None).
+        """
+        langs = [lang] if lang else [
+            row[0] for row in self.db.execute("SELECT DISTINCT lang FROM locale_files")
+        ]
+        missing = []
+        for lang in langs:
+            missing.extend(
+                (lang, key) for key, in self.db.execute(
+                    "SELECT DISTINCT key FROM keys WHERE NOT EXISTS "
+                    "(SELECT 1 FROM locale WHERE locale.lang = ? AND locale.key = keys.key) "
+                    "ORDER BY key",
+                    (lang,)
+                )
+            )
+        return missing
+
+    def unlabelled(self):
+        """
+        Return (path, tag, line, column) for every header without data-i18n
+        that the show command of i18n_set_label.py would label.
+        """
+        return self.db.execute(
+            "SELECT files.path, tag, line, col FROM headers "
+            "JOIN files ON files.id = headers.file_id "
+            "WHERE headers.key IS NULL AND (headers.id IS NULL OR headers.id != 'h1') "
+            "ORDER BY files.path, line, col"
+        ).fetchall()
+
+    def files_to_label(self, files):
+        """
+        Return the files with headers to label or with keys repeated inside
+        the file, the only ones where the show command changes something.
+        """
+        pending = {
+            path for path, in self.db.execute(
+                "SELECT DISTINCT files.path FROM headers "
+                "JOIN files ON files.id = headers.file_id "
+                "WHERE headers.key IS NULL AND (headers.id IS NULL OR headers.id != 'h1') "
+                "UNION SELECT files.path FROM keys "
+                "JOIN files ON files.id = keys.file_id "
+                "GROUP BY files.path, key HAVING COUNT(*) > 1"
+            )
+        }
+        return [file for file in files if os.path.abspath(file) in pending]
+
+
+@profiled("render")
+def show_table(datadict, color, fmt="simple"):
+    from tabulate import tabulate
+    print(color)
+    print(tabulate(datadict, headers="keys", tablefmt=fmt))
+    print(Style.RESET_ALL)
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+@click.option('--index', default=INDEX_FILE, show_default=True, help="sqlite file with the index")
+@profile_options
+@click.pass_context
+def cli(ctx, index):
+    ctx.obj = index
+
+
+@cli.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--locales', '-l', help="directory with the json files, e.g. static/i18n")
+@click.pass_obj
+def update(index, **kwargs):
+    """
+    To build or update the index with the templates and locale files
+
+    Only the templates and json files changed since the last update are
+    parsed again.
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_index.py update path/to/templates -l path/to/static/i18n
+
+    """
+    files = expand_paths(kwargs["paths"])
+    with KeyIndex(index) as key_index:
+        parsed = key_index.update(files)
+        loaded = key_index.update_locales(kwargs["locales"]) if kwargs["locales"] else 0
+    show_table({
+        "templates": [len(files)],
+        "templates parsed": [parsed],
+        "locale files loaded": [loaded]
+    }, Fore.LIGHTGREEN_EX)
+
+
+@cli.command()
+@click.argument('key')
+@click.pass_obj
+def files(index, key):
+    """To show all the files (and lines) using KEY"""
+    with KeyIndex(index) as key_index:
+        rows = key_index.files_using(key)
+    show_table({
+        "FILE": [row[0] for row in rows],
+        "LINE": [row[1] for row in rows],
+        "COLUMN": [row[2] for row in rows]
+    }, Fore.LIGHTGREEN_EX)
+
+
+@cli.command()
+@click.option('--lang', help="language of the locale file, e.g. es (all of them by default)")
+@click.pass_obj
+def missing(index, lang):
+    """To show the keys used in the templates without locale entry"""
+    with KeyIndex(index) as key_index:
+        rows = key_index.missing(lang)
+    show_table({
+        "LANG": [row[0] for row in rows],
+        "KEY WITHOUT ENTRY": [row[1] for row in rows]
+    }, Fore.LIGHTYELLOW_EX)
+
+
+@cli.command()
+@click.pass_obj
+def unlabelled(index):
+    """To show the headers without attribute 'data-i18n'"""
+    with KeyIndex(index) as key_index:
+        rows = key_index.unlabelled()
+    show_table({
+        "FILE": [row[0] for row in rows],
+        "TAG": [row[1] for row in rows],
+        "LINE": [row[2] for row in rows],
+        "COLUMN": [row[3] for row in rows]
+    }, Fore.LIGHTYELLOW_EX)
+
+
+@cli.command()
+@click.pass_obj
+def duplicates(index):
+    """To show the keys used more than once"""
+    with KeyIndex(index) as key_index:
+        rows = key_index.duplicates()
+    show_table({
+        "KEY DUPLICATES": [row[0] for row in rows],
+        "TIMES": [row[1] for row in rows]
+    }, Fore.LIGHTRED_EX)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,279 @@
+import re
+import html
+import click
+import textwrap
+from pathlib import Path
+from colorama import Fore, Style
+from bisect import bisect_right
+from i18n_cache import KeyCache, cached_extract
+from i18n_common import print_records
+from i18n_profile import profiled, profile_options
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+FORMATS = ["table", "ndjson", "quiet"]
+TOKEN_CACHE_FILE = ".i18n_tokens.json"
+TOKEN_CACHE_MAX_ENTRIES = 2000
+HTML, EXPR, STMT, COMMENT, TEXT, RAW = "html", "expr", "stmt", "comment", "text", "raw"
+JINJA = (EXPR, STMT, COMMENT)
+RAW_TAGS = ("script", "style")
+JINJA_PATTERN = r"\{\{.*?\}\}|\{%.*?%\}|\{\#.*?\#\}"
+TOKEN_RX = re.compile(rf"""(?=[{{<])(?:
+    (?P<{EXPR}>\{{\{{.*?\}}\}})
+  | (?P<{STMT}>\{{%.*?%\}})
+  | (?P<{COMMENT}>\{{\#.*?\#\}})
+  | (?P<{HTML}><!--.*?-->|<![^>]*>|<\?[^>]*>|</[A-Za-z][^>]*>
+      |<(?P<tag>[A-Za-z][^\s/>]*)
+        (?:[^"'>{{]+(?=["'>{{])|"[^"]*"|'[^']*'|{JINJA_PATTERN}|\{{(?![{{%\#]))*>)
+)""", re.S | re.X)
+TAG_NAME = re.compile(r"</?([A-Za-z][^\s/>]*)")
+DATAI18N_ATTR = re.compile(
+    r"""\sdata-i18n(?=[\s=/>])(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+)))?""", re.I
+)
+
+
+def tokenize(content):
+    """
+    Split content in a list of [kind, start, end] spans covering all of it:
+
+    - html: a start or end tag, a comment, a doctype or a processing
+      instruction. Jinja inside a start tag (e.g. in an attribute) is part
+      of the tag,
+    - expr, stmt, comment: a Jinja {{ expression }}, {% statement %} or
+      {# comment #},
+    - text: the text between them,
+    - raw: the content of a script or style element.
+
+    The spans are plain lists of a string and two offsets, so the token
+    stream of a template can be stored as json (see tokenize_files).
+    """
+    tokens = []
+    append = tokens.append
+    pos = 0
+    while pos is not None:
+        start = pos
+        for match in TOKEN_RX.finditer(content, start):
+            start, end = match.span()
+            if start > pos:
+                append([TEXT, pos, start])
+            append([match.lastgroup, start, end])
+            pos = end
+            name = match.group("tag")
+            if name and name.lower() in RAW_TAGS:
+                close = re.compile(rf"</{re.escape(name)}\s*>", re.I).search(content, pos)
+                end = close.start() if close else len(content)
+                if end > pos:
+                    append([RAW, pos, end])
+                pos = end
+                break
+        else:
+            if pos < len(content):
+                append([TEXT, pos, len(content)])
+            pos = None
+    return tokens
+
+
+def tag_name(content, token):
+    """Return the lowered name of the start tag token, or None"""
+    kind, start, end = token
+    if kind != HTML or content.startswith(("</", "<!", "<?"), start):
+        return None
+    return TAG_NAME.match(content, start).group(1).lower()
+
+
+def start_tags(content, tokens, names=None):
+    """
+    Yield (name, start, end) for every start tag of tokens, only the tags
+    in names if given.
+    """
+    for token in tokens:
+        name = tag_name(content, token)
+        if name is not None and (names is None or name in names):
+            yield name, token[1], token[2]
+
+
+def datai18n_value(content, start, end):
+    """
+    Return the last data-i18n attribute of the start tag content[start:end]
+    as a match of DATAI18N_ATTR (None if it has none) and the group with
+    its value (None if it has no value).
+    """
+    attrs = list(DATAI18N_ATTR.finditer(content, start, end))
+    if not attrs:
+        return None, None
+    attr = attrs[-1]
+    return attr, next((group for group in (1, 2, 3) if attr.group(group) is not None), None)
+
+
+def text_runs(tokens):
+    """
+    Yield the runs of consecutive text and Jinja tokens, as a browser
+    would see a text node once the template is rendered.
+    """
+    run = []
+    for token in tokens:
+        if token[0] == TEXT or token[0] in JINJA:
+            run.append(token)
+        elif run:
+            yield run
+            run = []
+    if run:
+        yield run
+
+
+def literal_lines(content, run, regex):
+    """
+    Yield (start, end) for every line of the run that has text outside
+    Jinja, when regex matches the text of the run with its Jinja removed.
+
+    The run is stripped of its leading and trailing newlines, as
+    BeautifulSoup text nodes were, so the lines are the ones of the text.
+    """
+    literal = [(start, end) for kind, start, end in run if kind == TEXT]
+    if not regex.search("".join(content[start:end] for start, end in literal)):
+        return
+    start, end = run[0][1], run[-1][2]
+    while start < end and content[start] == "\n":
+        start += 1
+    while end > start and content[end - 1] == "\n":
+        end -= 1
+    pieces = iter(literal)
+    piece = next(pieces, None)
+    while start < end:
+        stop = content.find("\n", start, end)
+        stop = end if stop == -1 else stop
+        found = False
+        while piece is not None and piece[0] < stop:
+            if content[max(piece[0], start):min(piece[1], stop)].strip():
+                found = True
+                break
+            if piece[1] > stop:
+                break
+            piece = next(pieces, None)
+        if found:
+            yield start, stop
+        start = stop + 1
+
+
+def find_text(content, tokens, regex, offsets):
+    """
+    Return the lines of text matching regex (see literal_lines), with the
+    html entities unescaped, and their line and column (1-based).
+
+    Lines mixing text and Jinja, e.g. 'Described by {{ name }}', are kept
+    as written in the template.
+    """
+    regex = re.compile(regex)
+    texts, positions = [], []
+    for run in text_runs(tokens):
+        for start, end in literal_lines(content, run, regex):
+            line = bisect_right(offsets, start)
+            texts.append(html.unescape(content[start:end].rstrip("\r")))
+            positions.append((line, start - offsets[line - 1] + 1))
+    return texts, positions
+
+
+def line_offsets(content):
+    offsets = [0]
+    offsets.extend(match.end() for match in re.finditer("\n", content))
+    return offsets
+
+
+@profiled("read", 0)
+def read_file(filename):
+    with open(filename, "r") as fstream:
+        content = fstream.read()
+    return content
+
+
+@profiled("lex", 0)
+def tokenize_file(filename):
+    return tokenize(read_file(filename))
+
+
+def token_cache(path=TOKEN_CACHE_FILE):
+    """
+    Return the manifest where the tokens of the templates are kept. It is
+    not the one of the keys (see i18n_cache), as the tokens of a template
+    take several times its size, and it keeps fewer files.
+    """
+    return KeyCache(path, TOKEN_CACHE_MAX_ENTRIES)
+
+
+def tokenize_files(files, cache=None):
+    """
+    Return the tokens of every file, in the same order as files, only
+    tokenizing the files missing in cache (see token_cache) if given.
+    """
+    return cached_extract(
+        files, lambda missing: [tokenize_file(file) for file in missing], cache, "tokens"
+    )
+
+
+@profiled("render")
+def show_table(datadict, color, fmt="simple"):
+    from tabulate import tabulate
+    print(color)
+    print(tabulate(datadict, headers="keys", tablefmt=fmt))
+    print(Style.RESET_ALL)
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+@profile_options
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('filename')
+@click.option('--kind', '-k', 'kinds', multiple=True, type=click.Choice([HTML, *JINJA, TEXT, RAW]), help="kind of token to show, can be repeated (all by default)")
+@click.option('--cache-file', help=f"manifest where the tokens of every file are kept, e.g. {TOKEN_CACHE_FILE}")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as a table, one json object per token, or nothing")
+def tokens(**kwargs):
+    """
+    To show the tokens of a template
+
+    The template is split once in html tags, Jinja expressions, statements
+    and comments, text and script or style content, with the line and
+    column (1-based) where every token starts.
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_lexer.py tokens path/to/file/<filename>.html -k expr -k stmt
+
+    """
+    filename = kwargs["filename"]
+    cache = token_cache(kwargs["cache_file"]) if kwargs["cache_file"] else None
+    content = read_file(filename)
+    offsets = line_offsets(content)
+    found = []
+    for kind, start, end in tokenize_files([filename], cache)[0]:
+        if kwargs["kinds"] and kind not in kwargs["kinds"]:
+            continue
+        line = bisect_right(offsets, start)
+        found.append({
+            "kind": kind,
+            "line": line,
+            "column": start - offsets[line - 1] + 1,
+            "text": content[start:end]
+        })
+
+    if kwargs["fmt"] == "ndjson":
+        print_records({"file": filename, **token} for token in found)
+    elif kwargs["fmt"] == "table":
+        show_table({
+                "KIND": [token["kind"] for token in found],
+                "LINE": [token["line"] for token in found],
+                "COLUMN": [token["column"] for token in found],
+                f"{Path(filename).name}: TOKEN": [
+                    textwrap.shorten(token["text"].replace("\n", "\\n"), width=60, placeholder="...")
+                    for token in found
+                ]
+            },
+            Fore.LIGHTCYAN_EX
+        )
+
+
+if __name__ == '__main__':
+    cli()
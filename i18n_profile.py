@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import click
+import functools
+from collections import defaultdict
+from contextlib import contextmanager
+
+PROFILE_TOP = 15
+
+
+class Profiler:
+    """
+    Wall time, CPU time and number of calls of every phase of a run.
+
+    Phases are recorded per file when the file is known. Nothing is recorded
+    until start is called, so instrumented code pays only one attribute
+    lookup when profiling is off. Phases running inside worker processes are
+    sent back with the results (see pool_map) and added to the ones of the
+    parent process.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = defaultdict(lambda: [0, 0.0, 0.0])
+        self.output = None
+        self.cprofile = None
+        self.top = PROFILE_TOP
+
+    def start(self, output, use_cprofile=False, top=PROFILE_TOP):
+        self.enabled = True
+        self.output = output
+        self.top = top
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        if use_cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextmanager
+    def phase(self, name, file=None):
+        if not self.enabled:
+            yield
+            return
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            record = self.phases[(name, str(file) if file is not None else "")]
+            record[0] += 1
+            record[1] += time.perf_counter() - wall
+            record[2] += time.process_time() - cpu
+
+    def merge(self, phases):
+        """Add the phases recorded by another process to the ones of this run"""
+        for key, (calls, wall, cpu) in phases.items():
+            record = self.phases[key]
+            record[0] += calls
+            record[1] += wall
+            record[2] += cpu
+
+    def trace(self):
+        phases = [
+            {"phase": name, "file": file, "calls": calls, "wall": wall, "cpu": cpu}
+            for (name, file), (calls, wall, cpu) in self.phases.items()
+        ]
+        totals = defaultdict(lambda: {"calls": 0, "wall": 0.0, "cpu": 0.0})
+        for record in phases:
+            for field in ("calls", "wall", "cpu"):
+                totals[record["phase"]][field] += record[field]
+        return {
+            "argv": sys.argv,
+            "wall": time.perf_counter() - self.wall,
+            "cpu": time.process_time() - self.cpu,
+            "totals": dict(totals),
+            "phases": sorted(phases, key=lambda record: -record["wall"])
+        }
+
+    def finish(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        trace = self.trace()
+        if self.cprofile is not None:
+            import pstats
+            self.cprofile.disable()
+            self.cprofile.dump_stats(f"{self.output}.prof")
+            stats = pstats.Stats(self.cprofile).sort_stats("cumulative")
+            trace["cprofile"] = [
+                {
+                    "function": f"{path}:{line}({function})",
+                    "calls": calls,
+                    "tottime": tottime,
+                    "cumtime": cumtime
+                }
+                for (path, line, function), (_, calls, tottime, cumtime, _)
+                in sorted(stats.stats.items(), key=lambda item: -item[1][3])[:self.top]
+            ]
+        with open(self.output, "w") as f:
+            json.dump(trace, f, indent=4)
+        print_summary(trace, self.top)
+
+
+def print_summary(trace, top=PROFILE_TOP):
+    from tabulate import tabulate
+    rows = [
+        {"phase": phase, **{field: round(value, 4) for field, value in total.items()}}
+        for phase, total in sorted(trace["totals"].items(), key=lambda item: -item[1]["wall"])
+    ]
+    print(f"\nPROFILE: wall {trace['wall']:.3f}s cpu {trace['cpu']:.3f}s", file=sys.stderr)
+    print(tabulate(rows, headers="keys", tablefmt="simple"), file=sys.stderr)
+    rows = [
+        {field: round(value, 4) if isinstance(value, float) else value
+         for field, value in record.items()}
+        for record in trace["phases"][:top]
+    ]
+    print(f"\nTOP {top} PHASES BY FILE", file=sys.stderr)
+    print(tabulate(rows, headers="keys", tablefmt="simple"), file=sys.stderr)
+
+
+PROFILER = Profiler()
+
+
+def phase(name, file=None):
+    return PROFILER.phase(name, file)
+
+
+def profiled(name, file_arg=None):
+    """
+    Decorator recording every call of the function as the phase name, for
+    the file passed as positional argument file_arg if given.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            file = args[file_arg] if file_arg is not None and len(args) > file_arg else None
+            with PROFILER.phase(name, file):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def call_recorded(function, item):
+    """
+    Call function(item) in a worker process recording its phases apart from
+    the ones the worker inherited, and return the result with them.
+    """
+    enabled, phases = PROFILER.enabled, PROFILER.phases
+    PROFILER.enabled, PROFILER.phases = True, defaultdict(lambda: [0, 0.0, 0.0])
+    try:
+        result = function(item)
+        return result, dict(PROFILER.phases)
+    finally:
+        PROFILER.enabled, PROFILER.phases = enabled, phases
+
+
+def pool_map(executor, function, items, chunksize=1):
+    """
+    Return the list of function(item) for every item, run by executor (a
+    ProcessPoolExecutor). When profiling, the phases of the workers are
+    added to the ones of this process.
+    """
+    if not PROFILER.enabled:
+        return list(executor.map(function, items, chunksize=chunksize))
+    results = []
+    for result, phases in executor.map(
+        functools.partial(call_recorded, function), items, chunksize=chunksize
+    ):
+        PROFILER.merge(phases)
+        results.append(result)
+    return results
+
+
+def run_pool(function, files, jobs=None):
+    """
+    Return the list of function(file) for every file, run in a pool of jobs
+    worker processes (one per core by default), or in this process for one
+    job or one file.
+
+    function must be picklable and return plain data, and it should report
+    its errors in its result rather than raise them, as an exception stops
+    the whole batch.
+    """
+    if jobs == 1 or len(files) < 2:
+        return [function(file) for file in files]
+    from concurrent.futures import ProcessPoolExecutor
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(files) // (workers * 4))
+    with phase("pool"), ProcessPoolExecutor(max_workers=workers) as executor:
+        return pool_map(executor, function, files, chunksize)
+
+
+def profile_options(group):
+    """
+    Add the --profile, --cprofile and --profile-top options to a click group
+    and start the profiler when --profile is given. The trace is written
+    when the command finishes.
+    """
+    @click.option('--profile', 'profile_output', metavar="TRACE.json",
+                  help="write the time spent in every phase to this json file")
+    @click.option('--cprofile', is_flag=True,
+                  help="with --profile, also run cProfile and write TRACE.json.prof")
+    @click.option('--profile-top', type=int, default=PROFILE_TOP, show_default=True,
+                  help="rows of the profile summary")
+    @click.pass_context
+    @functools.wraps(group)
+    def wrapper(ctx, profile_output, cprofile, profile_top, *args, **kwargs):
+        if profile_output:
+            PROFILER.start(profile_output, cprofile, profile_top)
+            ctx.call_on_close(PROFILER.finish)
+        return ctx.invoke(group, *args, **kwargs)
+    return wrapper
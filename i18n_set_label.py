@@ -1,30 +1,41 @@
-import re
-import os
+import sys
+import json
+import html
 import click
-from bs4 import BeautifulSoup
-from tabulate import tabulate
 from colorama import Fore, Style
 from pathlib import Path
 from operator import itemgetter
-from collections import Counter
-import subprocess
+from bisect import bisect_right
+from collections import Counter, defaultdict
+import difflib
 import textwrap
-import pdb
+from functools import partial
+from i18n_atomic import write_atomic, stage, commit_summaries
+from i18n_common import expand_paths, print_records
+from i18n_lexer import tokenize, start_tags, datai18n_value, line_offsets
+from i18n_profile import phase, profiled, profile_options, run_pool
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+HEADERS = ["h1", "h2", "h3", "h4", "h5"]
+JINJA_MARKS = ("{{", "{%", "{#")
+FORMATS = ["table", "ndjson", "quiet"]
+PREFIX_TAGS = ["h1", "h2", "h3", "h4"]
 
 
+@profiled("read", 0)
 def read_file(filename):
-    with open(filename, "r") as fstream:
+    with open(filename, "r", newline="") as fstream:
         content = fstream.read()
     return content
 
 
+@profiled("write", 0)
 def write_file(filename, content):
-    with open(filename, "w") as f:
-        f.write(content)
+    return write_atomic(filename, content)
 
+@profiled("render")
 def show_table(content, color, fmt='pretty', header="keys",colalign=None):
+    from tabulate import tabulate
     print(color)
     print(tabulate(
         content,
@@ -34,12 +45,15 @@ def show_table(content, color, fmt='pretty', header="keys",colalign=None):
     ))
     print(Style.RESET_ALL)
 
+@profiled("render")
 def print_header(content,color):
     print(color)
     print(f"{content.center(120,'=')}")
     print(Style.RESET_ALL)
 
+@profiled("render")
 def print_message(content, color, fmt):
+    from tabulate import tabulate
     print(color)
     print(tabulate(
         content,
@@ -48,6 +62,7 @@ def print_message(content, color, fmt):
     ))
     print(Style.RESET_ALL)
 
+@profiled("render")
 def print_info(content,title,color,type='text'):
         print(color)
         print(title)
@@ -58,92 +73,372 @@ def print_info(content,title,color,type='text'):
             print(json.dumps(content, indent=4))
         print(Style.RESET_ALL)
 
-def show_diff(filename):
-    file=Path(filename)
-    basename = file.parent.as_posix()
-    name = file.name
-    os.chdir(basename)
+def hunk_range(start, length):
+    if length == 1:
+        return f"{start + 1}"
+    return f"{start + 1 if length else start},{length}"
 
-    print_header(" GIT STATUS ", Fore.MAGENTA)
-    subprocess.run(["git","status"])
-    
-    print_header(f" GIT DIFF: {name} ", Fore.MAGENTA)
-    subprocess.run(["git","--no-pager","diff", name])
-
-def replace_new_tag(kwargs):
-    name, attr_text, pattern, content, new_content = (
-        itemgetter(
-            "name",
-            "attr_text", 
-            "pattern", 
-            "content",
-            "new_content"
-            )(kwargs)
-    )
-    matches = re.finditer(pattern, content)
-    for match in matches:
-        oldtag = match.group(0)
-        idx = re.search(">",oldtag).span()[0]
-        newtag = f"{oldtag[:idx]} data-i18n=\"{name}-{attr_text}\"{oldtag[idx:]}"
-        new_content = new_content.replace(oldtag, newtag) 
-    return new_content
-
-def replace_repeated(kwargs):
-    pattern, attr_text, new_content, loc = (
-        itemgetter(
-            "pattern",
-            "attr_text", 
-            "new_content",
-            "loc"
-            )(kwargs)
-    )
 
-    matches = re.finditer(pattern, new_content)
-
-    for match in matches:
-        oldtag = match.group(0)
-        oldattr = f"data-i18n=\"{attr_text}\""
-        newattr = f"data-i18n=\"{attr_text}-w{loc}\""
-        newtag = oldtag.replace(oldattr,newattr)
-        new_content = new_content.replace(oldtag,newtag)
-        return new_content
-
-def create_collection(attr_content,loc_repeated):
-    array = []
-    i = 0
-    olditem=''
-    for item,loc in loc_repeated:
-        if item != olditem:
-            i=0
-        array.append((i,item,loc))
-        olditem=item
-        i+=1
-    return array
-        
-
-def check_repeated(new_content):
-    soupend = BeautifulSoup(new_content,'html.parser')
-    alltags = soupend.find_all([],{'data-i18n':True})
-    attr_content = [tag.get('data-i18n') for tag in alltags]
-    loc_repeated = [(x,i) for i, x in enumerate(attr_content) if attr_content.count(x)>1]
-    
-    if loc_repeated:
-        for loc,content,i in create_collection(attr_content, loc_repeated):
-            tag = alltags[i]
-            pattern=r"(<{}[^>]*\sdata\-i18n\b=\"{}\"[^>]*>{})".format(
-                tag.name, content, next(tag.children)
-            )
-            new_content = replace_repeated({
-                "pattern":pattern,
-                "attr_text": tag.get("data-i18n"),
-                "new_content": new_content,
-                "loc":loc
-            })
-        return new_content
+@profiled("diff", 2)
+def unified_diff(old, new, filename, context=3):
+    """
+    Return the unified diff (as difflib.unified_diff) of the contents old
+    and new of filename as a list of lines.
+
+    Inserting attributes never adds or removes lines, so when both contents
+    have the same number of lines they are compared one to one instead of
+    running the sequence matcher of difflib.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    fromfile, tofile = f"a/{filename}", f"b/{filename}"
+    if len(old_lines) != len(new_lines):
+        return list(difflib.unified_diff(old_lines, new_lines, fromfile, tofile, n=context))
+
+    changed = [i for i, (a, b) in enumerate(zip(old_lines, new_lines)) if a != b]
+    if not changed:
+        return []
+    groups = [[changed[0]]]
+    for i in changed[1:]:
+        if i - groups[-1][-1] - 1 > 2 * context:
+            groups.append([])
+        groups[-1].append(i)
+
+    diff = [f"--- {fromfile}\n", f"+++ {tofile}\n"]
+    for group in groups:
+        start = max(group[0] - context, 0)
+        end = min(group[-1] + context + 1, len(old_lines))
+        diff.append(f"@@ -{hunk_range(start, end - start)} +{hunk_range(start, end - start)} @@\n")
+        i = start
+        while i < end:
+            if old_lines[i] == new_lines[i]:
+                diff.append(f" {old_lines[i]}")
+                i += 1
+                continue
+            run = i
+            while run < end and old_lines[run] != new_lines[run]:
+                run += 1
+            diff.extend(f"-{line}" for line in old_lines[i:run])
+            diff.extend(f"+{line}" for line in new_lines[i:run])
+            i = run
+    return diff
+
+
+DIFF_COLORS = {"+": Fore.GREEN, "-": Fore.RED, "@": Fore.CYAN}
+
+
+@profiled("render")
+def show_diff(filename, diff):
+    """
+    To print the diff computed by unified_diff for filename, nothing is
+    read from the disk so it can be shown before writing the file.
+    """
+    print_header(f" DIFF: {Path(filename).name} ", Fore.MAGENTA)
+    if not diff:
+        print("Nothing to change")
+        return
+    for line in diff:
+        line = line.rstrip("\n")
+        color = DIFF_COLORS.get(line[0], "") if not line.startswith(("---", "+++")) else Style.BRIGHT
+        sys.stdout.write(f"{color}{line}{Style.RESET_ALL}\n" if color else f"{line}\n")
+
+def tag_spans(content, tokens):
+    """Return the end of every start tag of tokens by its start"""
+    return {start: end for _, start, end in start_tags(content, tokens)}
+
+
+def in_template(tags, offsets, spans):
+    """
+    Return the tags that are start tags of the template, leaving out the
+    ones BeautifulSoup finds inside Jinja, scripts or styles.
+    """
+    return [tag for tag in tags if offsets[tag.sourceline - 1] + tag.sourcepos in spans]
+
+
+def starttag_span(tag, offsets, spans):
+    start = offsets[tag.sourceline - 1] + tag.sourcepos
+    return start, spans[start]
+
+
+def datai18n_text(tag):
+    if tag.has_attr("id"):
+        return tag.get("id").replace("-header","").lower()
+    return tag.text.lower().strip().replace(" ","-")
+
+
+def parse_headers(filename, content, tokens):
+    """
+    Return the BeautifulSoup tree of content, or None when its tokens have
+    no header start tag, so a template without headers is never parsed.
+
+    The headers are the only thing still taken from BeautifulSoup: their
+    keys are made from the text of the tag as BeautifulSoup gives it (with
+    its nested tags, up to where it closes an unclosed header), which the
+    tokens alone do not give, and the keys of the templates already
+    labelled must not change.
+    """
+    if next(start_tags(content, tokens, HEADERS), None) is None:
+        return None
+    from bs4 import BeautifulSoup
+    with phase("parse", filename):
+        return BeautifulSoup(content, 'html.parser')
+
+
+def find_insertions(soup, content, offsets, name, spans):
+    """
+    Return the headers of soup (see parse_headers, None for no headers) and
+    the changes needed to label them, only the ones whose start tag is in
+    spans (see tag_spans).
+
+    Every change is a dict with the tag and the info to show. When the tag
+    needs the attribute, it also has the start of the tag, the key and the
+    source offset where the attribute must be inserted (just before the '>'
+    or the '/>' closing the start tag). Headers without text nor id to make
+    the key from, or whose key would have Jinja (rendered as a different
+    key on every page) or a '"' (ending the attribute), are left as they
+    are.
+    """
+    if soup is None:
+        return [], [], []
+    headers_with_id = in_template(soup.find_all(HEADERS, {"id":True}), offsets, spans)
+    headers_without_id = in_template(soup.find_all(HEADERS, {"id":False}), offsets, spans)
+
+    changes = []
+    for tag in headers_with_id + headers_without_id:
+        if tag.get("id") == "h1":
+            continue
+        if tag.has_attr("data-i18n"):
+            changes.append({"tag": tag, "info": "Nothing to change"})
+            continue
+        text = datai18n_text(tag)
+        if not text or any(mark in text for mark in JINJA_MARKS):
+            changes.append({"tag": tag, "info": "No text nor id to make the key"})
+            continue
+        if '"' in text:
+            changes.append({"tag": tag, "info": "The key would have a '\"'"})
+            continue
+        start, end = starttag_span(tag, offsets, spans)
+        offset = end - 1
+        if content[offset - 1] == "/":
+            offset = len(content[start:offset - 1].rstrip()) + start
+        changes.append({
+            "tag": tag,
+            "info": "Change",
+            "start": start,
+            "offset": offset,
+            "key": f"{name}-{text}"
+        })
+    return headers_with_id, headers_without_id, changes
+
+
+def number_occurrences(content, tokens, changes):
+    """
+    Return every data-i18n of the final document, in document order, as
+    (start, key, suffix, offset, prefix, change) with the suffix '-w{loc}'
+    for every key that is repeated.
+
+    The keys already present in the document and the new ones are indexed
+    once, so the n-th occurrence of a repeated key gets the suffix '-w{n}'
+    whether the attribute is new (change is not None) or not. The keys
+    already present are read from the start tags of tokens, unescaped.
+    """
+    occurrences = []
+    for _, start, end in start_tags(content, tokens):
+        match, group = datai18n_value(content, start, end)
+        if match is None:
+            continue
+        if group is None:
+            occurrences.append((start, "", match.end(), "=", None))
+        else:
+            occurrences.append((
+                start, html.unescape(match.group(group)), match.end(group), "", None
+            ))
+    for change in changes:
+        if "offset" in change:
+            occurrences.append((
+                change["start"], change["key"], change["offset"], "", change
+            ))
+    occurrences.sort(key=itemgetter(0))
+
+    positions = defaultdict(list)
+    for occurrence in occurrences:
+        positions[occurrence[1]].append(occurrence)
+
+    numbered = []
+    for key, found in positions.items():
+        repeated = len(found) > 1
+        for loc, (start, key, offset, prefix, change) in enumerate(found):
+            suffix = f"-w{loc}" if repeated else ""
+            numbered.append((start, key, suffix, offset, prefix, change))
+    return sorted(numbered, key=itemgetter(0))
+
+
+def check_repeated(occurrences):
+    """
+    Return the insertions of the changes numbered in occurrences (see
+    number_occurrences), adding '-w{loc}' to every key that is repeated in
+    the final document. The key inserted for every change, with its suffix,
+    is kept in change["label"].
+    """
+    insertions = []
+    for start, key, suffix, offset, prefix, change in occurrences:
+        if change is not None:
+            change["label"] = f"{key}{suffix}"
+            insertions.append((offset, f" data-i18n=\"{key}{suffix}\""))
+        elif suffix:
+            insertions.append((offset, f"{prefix}{suffix}"))
+    return insertions
+
+
+def replace_spans(content, replacements):
+    """Return content with every (start, end, text) of replacements done"""
+    pieces = []
+    last = 0
+    for start, end, text in replacements:
+        pieces.append(content[last:start])
+        pieces.append(text)
+        last = end
+    pieces.append(content[last:])
+    return "".join(pieces)
+
+
+def splice(content, insertions):
+    pieces = []
+    last = 0
+    for offset, text in sorted(insertions, key=itemgetter(0)):
+        pieces.append(content[last:offset])
+        pieces.append(text)
+        last = offset
+    pieces.append(content[last:])
+    return "".join(pieces)
+
+
+def label_content(filename, content, tokens=None):
+    """
+    Return the headers of content, the changes needed to label them and the
+    labelled content. The tokens of content (see i18n_lexer.tokenize) are
+    computed when not given.
+    """
+    name = Path(filename).stem.replace("_","-").lower()
+    if tokens is None:
+        with phase("lex", filename):
+            tokens = tokenize(content)
+    soup = parse_headers(filename, content, tokens)
+    with phase("rewrite", filename):
+        offsets = line_offsets(content)
+        spans = tag_spans(content, tokens)
+        headers_with_id, headers_without_id, changes = find_insertions(
+            soup, content, offsets, name, spans
+        )
+        occurrences = number_occurrences(content, tokens, changes)
+        new_content = splice(content, check_repeated(occurrences))
+    return headers_with_id, headers_without_id, changes, new_content
+
+
+def save_file(summary, filename, content, defer=False):
+    """
+    Write content to filename, or only stage it (see i18n_atomic.stage) in
+    summary["staged"] when defer is set, for the caller to commit it.
+    """
+    if defer:
+        with phase("write", filename):
+            summary["staged"] = stage(filename, content)
     else:
-        return new_content
+        summary["written"] = write_file(filename, content)
+
+
+def label_file(filename, replace=False, showfinal=False, diff=False, defer=False):
+    """
+    Label the headers of filename and return a summary of the result, with
+    the unified diff of the change when diff is set. With defer, the new
+    content is only staged (see save_file). An error reading, parsing or
+    writing the file is reported as the status 'error' of the summary.
+    """
+    summary = {"filename": filename, "status": "unchanged", "changes": 0, "info": "", "written": False}
+    try:
+        content = read_file(filename)
+        *_, changes, new_content = label_content(filename, content)
+        summary["changes"] = sum("offset" in change for change in changes)
+        if new_content != content:
+            summary["status"] = "changed"
+            if replace:
+                save_file(summary, filename, new_content, defer)
+        if showfinal:
+            summary["new_content"] = new_content
+        if diff:
+            summary["diff"] = unified_diff(content, new_content, filename)
+    except Exception as error:
+        summary.update({"status": "error", "info": f"{type(error).__name__}: {error}"})
+    return summary
+
+
+def prefix_keys(filename, content, tags=PREFIX_TAGS, tokens=None):
+    """
+    Prefix with the page name every data-i18n value of the start tags of
+    tags in content, found in its tokens (see i18n_lexer.tokenize, they are
+    computed when not given).
+
+    Return the new content and one dict per data-i18n found with its tag,
+    line, column, old and new key. Keys already prefixed are kept as they
+    are, the others are lowered.
+    """
+    name = Path(filename).stem.replace("_","-").lower()
+    if tokens is None:
+        with phase("lex", filename):
+            tokens = tokenize(content)
+    found = []
+    insertions = []
+
+    with phase("rewrite", filename):
+        for tag, start, end in start_tags(content, tokens, {tag.lower() for tag in tags}):
+            attr, group = datai18n_value(content, start, end)
+            if group is None:
+                continue
+            key = attr.group(group)
+            newkey = key if key.startswith(f"{name}-") else f"{name}-{key.lower()}"
+            found.append({
+                "tag": tag,
+                "start": start,
+                "key": key,
+                "new": newkey,
+                "changed": newkey != key
+            })
+            if newkey != key:
+                insertions.append((attr.start(group), attr.end(group), newkey))
+        new_content = replace_spans(content, insertions)
+        offsets = line_offsets(content)
+        for change in found:
+            start = change.pop("start")
+            line = bisect_right(offsets, start)
+            change.update({"line": line, "column": start - offsets[line - 1] + 1})
+    return new_content, found
+
+
+def prefix_file(filename, tags=PREFIX_TAGS, replace=False, showfinal=False, diff=False, defer=False):
+    """
+    Prefix the keys of filename (see prefix_keys) and return a summary of
+    the result, with errors reported as in label_file. With defer, the new
+    content is only staged (see save_file).
+    """
+    summary = {"filename": filename, "status": "unchanged", "changes": [], "info": "", "written": False}
+    try:
+        content = read_file(filename)
+        new_content, summary["changes"] = prefix_keys(filename, content, tags)
+        if new_content != content:
+            summary["status"] = "changed"
+            if replace:
+                save_file(summary, filename, new_content, defer)
+        if showfinal:
+            summary["new_content"] = new_content
+        if diff:
+            summary["diff"] = unified_diff(content, new_content, filename)
+    except Exception as error:
+        summary.update({"status": "error", "info": f"{type(error).__name__}: {error}"})
+    return summary
+
 
 @click.group(context_settings=CONTEXT_SETTINGS)
+@profile_options
 def cli():
     pass
 
@@ -152,8 +447,9 @@ def cli():
 @click.argument('filename')
 @click.option('--showfinal', '-sf', is_flag=True, help="to show the insertion in dry-run way")
 @click.option('--replace', is_flag=True, help='to insert the data-i18n attr in-place')
-@click.option('--show-diff','-sd', is_flag=True,help="to show the git status and diff of file changed")
+@click.option('--show-diff','-sd', is_flag=True,help="to show the diff of the changes, before writing them")
 @click.option('--overwrite','-ow',is_flag=True,help="to overwrite the data-i18n attr on files changed")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as tables, one json object per header, or nothing")
 def show(**kwargs):
     """
     To check all tags h1,h2,h3 tags and insert attr 'data-i18n'
@@ -173,185 +469,272 @@ def show(**kwargs):
 
         $ python i18n_set_label.py show path/to/file/<filename>.html --replace -sd/--show-diff
 
-        where the option -sd is used to show the git status and git diff of the file changed
+        where the option -sd is used to show the diff of the changes (also
+        without --replace, as a preview)
 
     """
     filename = kwargs["filename"]
-    name = Path(filename).stem.replace("_","-").lower()
 
     content = read_file(filename)
-    new_content = content[:]
-
-    soupini = BeautifulSoup(content, 'html.parser')
-
-    headers_with_id = soupini.find_all(["h1", "h2", "h3", "h4","h5"], {"id":True})
-    headers_without_id = soupini.find_all(["h1", "h2", "h3", "h4","h5"], {"id":False})
-
-    print_header(f' TAGS FOUND IN {Path(filename).name} ', Fore.LIGHTCYAN_EX)
-    show_table({"Headers with id": headers_with_id}, Fore.GREEN)
-    show_table({"Headers without id": headers_without_id}, Fore.GREEN)
-
-    for tag in headers_with_id:
-        if tag.get("id") != "h1":
-            id_text = tag.get("id")
-            datai18n_text = id_text.replace("-header","").lower()
-            if not tag.has_attr("data-i18n"):
-                 pattern = r"(<{}[^>]*\sid\b=\"{}\"[^>]*>)".format(tag.name,tag.get("id"))
-                 new_content = replace_new_tag({
-                     "name":name,
-                     "pattern":pattern,
-                     "content":content,
-                     "new_content":new_content,
-                     "attr_text":datai18n_text
-                 })
-                 print_message({
-                        "FILENAME": [Path(filename).name],
-                        "TAG: " : [textwrap.fill(str(tag), width=60)],
-                        "INFO": ["Change"]
-                    }, 
-                    Fore.LIGHTYELLOW_EX, "simple"
-                )             
-            else:
-                print_message({
-                        "FILENAME": [Path(filename).name],
-                        "TAG: " : [textwrap.fill(str(tag), width=60)],
-                        "INFO": ["Nothing to change"]
-                    }, 
-                    Fore.LIGHTRED_EX, "simple"
-                )
-
-   
-    for tag in headers_without_id:
-        if tag.attrs:
-            if not tag.has_attr("data-i18n"):
-
-                attrs_name = list(tag.attrs.keys())
-                attrs_vals = list(tag.attrs.values())
-                tag_content = next(tag.children)
-                # if bool(re.search("<.*>",str(tag_content))):
-                #     datai18n_text = tag_content.text.lower().strip().replace(" ","-")
-                # else:
-                #     datai18n_text = tag.text.lower().strip().replace(" ","-")
-                datai18n_text = tag.text.lower().strip().replace(" ","-")
-                pattern = r"(<{}[^>]*\s{}\b=\"{}\"[^>]*>{})".format(
-                    tag.name, attrs_name[0], " ".join(attrs_vals[0]), tag_content
-                )
-                new_content = replace_new_tag({
-                        "name":name,
-                        "pattern":pattern,
-                        "content":content,
-                        "new_content":new_content,
-                        "attr_text":datai18n_text
-                })
-                print_message({
-                        "FILENAME": [Path(filename).name],
-                        "TAG: " : [textwrap.fill(str(tag), width=60)],
-                        "INFO": ["Change"]
-                    }, 
-                    Fore.LIGHTYELLOW_EX , "simple"
-                )  
-            else:
-                print_message({
-                        "FILENAME": [Path(filename).name],
-                        "TAG: " : [textwrap.fill(str(tag), width=60)],
-                        "INFO": ["Nothing to change"]
-                    }, 
-                    Fore.LIGHTRED_EX, "simple"
-                )
-        else:
-            datai18n_text = tag.text.lower().strip().replace(" ","-")
-            pattern = r"(<{}>{})".format(tag.name, tag.text)
-            new_content = replace_new_tag({
-                        "name":name,
-                        "pattern":pattern,
-                        "content":content,
-                        "new_content":new_content,
-                        "attr_text":datai18n_text
-            })
+    headers_with_id, headers_without_id, changes, new_content = label_content(
+        filename, content
+    )
+
+    if kwargs["fmt"] == "ndjson":
+        print_records(
+            {
+                "file": filename,
+                "tag": change["tag"].name,
+                "line": change["tag"].sourceline,
+                "column": change["tag"].sourcepos + 1,
+                "info": change["info"],
+                "key": change.get("label", change["tag"].get("data-i18n"))
+            }
+            for change in changes
+        )
+    elif kwargs["fmt"] == "table":
+        print_header(f' TAGS FOUND IN {Path(filename).name} ', Fore.LIGHTCYAN_EX)
+        show_table({"Headers with id": headers_with_id}, Fore.GREEN)
+        show_table({"Headers without id": headers_without_id}, Fore.GREEN)
+
+        for change in changes:
             print_message({
-                        "FILENAME": [Path(filename).name],
-                        "TAG: " : [textwrap.fill(str(tag), width=60)],
-                        "INFO": ["Change"]
-                    }, 
-                    Fore.LIGHTYELLOW_EX , "simple"
+                    "FILENAME": [Path(filename).name],
+                    "TAG: " : [textwrap.fill(str(change["tag"]), width=60)],
+                    "INFO": [change["info"]]
+                },
+                Fore.LIGHTYELLOW_EX if "offset" in change else Fore.LIGHTRED_EX,
+                "simple"
             )
 
-    new_content = check_repeated(new_content)
-
     if kwargs["showfinal"]:
         print_header(" RESULT ",Fore.MAGENTA)
         print_info(new_content, f"{'with bs4':^30s}", Fore.YELLOW)
 
-    if kwargs["replace"]:
-        write_file(filename, new_content)
-
     if kwargs["show_diff"]:
-        show_diff(filename)
-    
+        show_diff(filename, unified_diff(content, new_content, filename))
+
+    if kwargs["replace"]:
+        written = write_file(filename, new_content)
+        if kwargs["fmt"] == "table" and not written:
+            print_header(f" {Path(filename).name}: NOTHING CHANGED, NOT WRITTEN ", Fore.LIGHTYELLOW_EX)
 
 
 @cli.command()
-@click.argument('filename')
+@click.argument('paths', nargs=-1, required=True)
 @click.option('--showfinal', '-sf', is_flag=True, help="to show the insertion in dry-run way")
 @click.option('--replace', is_flag=True, help='to insert the data-i18n attr in-place')
-@click.option('--show-diff','-sd', is_flag=True,help="to show the git status and diff of file changed")
-def overwrite(**kwargs):
-    filename = kwargs["filename"]
-    name = Path(filename).stem.replace("_","-").lower()
+@click.option('--show-diff','-sd', is_flag=True,help="to show the diff of the changes, before writing them")
+@click.option('--tag', '-t', 'tags', multiple=True, default=PREFIX_TAGS, show_default=True, help="tag whose data-i18n is prefixed, can be repeated")
+@click.option('--jobs', '-j', type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as tables, one json object per header, or nothing")
+@click.pass_context
+def overwrite(ctx, **kwargs):
+    """
+    To prefix the attr 'data-i18n' with the name of the page
 
-    content = read_file(filename)
-    new_content = content[:]
+    Every 'data-i18n' of the h1, h2, h3 and h4 tags (see --tag) that does
+    not start with the name of the file is prefixed with it. The files of
+    the given globs or directories are rewritten in one pass each, spread
+    across a pool of worker processes.
+
+    HOW TO USE
+
+    ===========
 
-    print_header(f' FOUND TAGS IN {Path(filename).name} ', Fore.LIGHTCYAN_EX)
+    1. For showing the keys that would change:
 
-    soupini = BeautifulSoup(content, 'html.parser')
-    matches = soupini.find_all(["h1", "h2", "h3", "h4"], {"data-i18n": True})
-    show_table({"bs4": matches},
-               Fore.BLUE,
-               fmt="plain",
-               header=[f"+{'bs4: with id':-^100s}+"]
+        $ python i18n_set_label.py overwrite path/to/file/<filename>.html
+
+    2. For prefixing the keys of every h2 and h3 of the site in-place:
+
+        $ python i18n_set_label.py overwrite path/to/templates -t h2 -t h3 --replace
+
+    """
+    fmt = kwargs["fmt"]
+    summaries = run_pool(
+        partial(
+            prefix_file,
+            tags=kwargs["tags"],
+            replace=kwargs["replace"],
+            showfinal=kwargs["showfinal"],
+            diff=kwargs["show_diff"],
+            defer=True
+        ),
+        expand_paths(kwargs["paths"]),
+        kwargs["jobs"]
     )
+    written = commit_summaries(summaries)
+
+    for summary in summaries:
+        filename = summary["filename"]
+        if fmt == "ndjson":
+            print_records({"file": filename, **change} for change in summary["changes"])
+        elif fmt == "table":
+            print_header(f' FOUND TAGS IN {Path(filename).name} ', Fore.LIGHTCYAN_EX)
+            if summary["status"] == "error":
+                print(f"{Fore.LIGHTRED_EX}{summary['info']}{Style.RESET_ALL}")
+            for change in summary["changes"]:
+                if change["changed"]:
+                    print(f"data-i18n=\"{change['key']}\" --> data-i18n=\"{change['new']}\"")
+                else:
+                    print(f"{change['key']} --> Nothing to change....")
+
+        if kwargs["showfinal"] and "new_content" in summary:
+            print_header(" RESULT ",Fore.MAGENTA)
+            print_info(summary["new_content"], f"{' New content':^30s}", Fore.YELLOW)
+
+        if kwargs["show_diff"] and "diff" in summary:
+            show_diff(filename, summary["diff"])
+
+    errors = sum(summary["status"] == "error" for summary in summaries)
+    if kwargs["replace"] and fmt == "table":
+        print_header(
+            f" {len(summaries)} FILES: {written} WRITTEN, "
+            f"{len(summaries) - written - errors} SKIPPED AS UNCHANGED, {errors} ERRORS ",
+            Fore.LIGHTCYAN_EX
+        )
+    if errors:
+        ctx.exit(1)
 
-    for match in matches:
-        datai18n_text = match.get("data-i18n")
-        oldattr = f"data-i18n=\"{datai18n_text}\""
-        if datai18n_text.startswith(f"{name}-"):
-            print(f"{datai18n_text} --> Nothing to change....")
-        else:
-            newattr = f"data-i18n=\"{name}-{datai18n_text.lower()}\""
-            print(f"{oldattr} --> {newattr}")
-            new_content = new_content.replace(oldattr, newattr)
+@cli.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--jobs', '-j', type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.option('--showfinal', '-sf', is_flag=True, help="to show the insertion in dry-run way")
+@click.option('--replace', is_flag=True, help='to insert the data-i18n attr in-place')
+@click.option('--show-diff','-sd', is_flag=True,help="to show the diff of the changes of every file")
+@click.option('--index', help="sqlite index (see i18n_index.py) used to skip the files with nothing to label")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as tables, one json object per file, or nothing")
+@click.pass_context
+def batch(ctx, **kwargs):
+    """
+    To insert attr 'data-i18n' in several files at once
 
-    if kwargs["showfinal"]:
-        print_header(" RESULT ",Fore.MAGENTA)
-        print_info(new_content, f"{' New content':^30s}", Fore.YELLOW)
+    This command does the same as 'show' for every html file found in the
+    given globs or directories, spreading the files across a pool of
+    worker processes, and shows one summary for all of them.
 
-    if kwargs["replace"]:
-        write_file(filename, new_content)
+    HOW TO USE
+
+    ===========
+
+    1. For showing which files would change:
+
+        $ python i18n_set_label.py batch "path/to/templates/*.html" path/to/other/dir
+
+    2. For doing the insertion in-place with 4 workers:
+
+        $ python i18n_set_label.py batch path/to/templates --replace -j 4
+
+    3. For previewing the changes of every file as a diff:
+
+        $ python i18n_set_label.py batch path/to/templates -sd
+
+    """
+    files = expand_paths(kwargs["paths"])
+    pending = files
+    if kwargs["index"]:
+        from i18n_index import KeyIndex
+        with KeyIndex(kwargs["index"]) as key_index:
+            key_index.update(files)
+            pending = key_index.files_to_label(files)
+
+    summaries = run_pool(
+        partial(
+            label_file,
+            replace=kwargs["replace"],
+            showfinal=kwargs["showfinal"],
+            diff=kwargs["show_diff"],
+            defer=True
+        ),
+        pending,
+        kwargs["jobs"]
+    )
+    written = commit_summaries(summaries)
+    skipped = set(files) - set(pending)
+    summaries += [
+        {"filename": file, "status": "unchanged", "changes": 0, "info": "nothing to label in the index", "written": False}
+        for file in files if file in skipped
+    ]
+
+    if kwargs["showfinal"]:
+        for summary in summaries:
+            if "new_content" in summary:
+                print_header(f" RESULT: {Path(summary['filename']).name} ", Fore.MAGENTA)
+                print_info(summary["new_content"], f"{'with bs4':^30s}", Fore.YELLOW)
+
+    if kwargs["show_diff"] and kwargs["fmt"] == "table":
+        for summary in summaries:
+            if summary.get("diff"):
+                show_diff(summary["filename"], summary["diff"])
+
+    totals = Counter(summary["status"] for summary in summaries)
+    if kwargs["fmt"] == "ndjson":
+        print_records(
+            {
+                key: "".join(value) if key == "diff" else value
+                for key, value in summary.items() if key != "new_content"
+            }
+            for summary in summaries
+        )
+    elif kwargs["fmt"] == "table":
+        show_table({
+                "FILENAME": [summary["filename"] for summary in summaries],
+                "STATUS": [summary["status"] for summary in summaries],
+                "NEW LABELS": [summary["changes"] for summary in summaries],
+                "INFO": [summary["info"] for summary in summaries]
+            },
+            Fore.LIGHTYELLOW_EX,
+            fmt="simple"
+        )
+
+        print_header(
+            f" {len(files)} FILES: {totals['changed']} CHANGED, "
+            f"{totals['unchanged']} UNCHANGED, {totals['error']} ERRORS ",
+            Fore.LIGHTCYAN_EX
+        )
+        if kwargs["replace"]:
+            print_header(
+                f" {written} WRITTEN, {len(files) - written - totals['error']} SKIPPED AS UNCHANGED ",
+                Fore.LIGHTCYAN_EX
+            )
+    if totals["error"]:
+        ctx.exit(1)
 
-    if kwargs["show_diff"]:
-        show_diff(filename)
 
 @cli.command()
-@click.argument('filename')
-def showdiff(filename):
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--jobs', '-j', type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.pass_context
+def showdiff(ctx, paths, jobs):
     """
-    To show git status/diff of file changed
+    To show the diff of the labels that would be inserted
 
-    This command allows to show the git status and git diff of the file chnged
+    This command allows to preview, as a unified diff, the changes that
+    'show --replace' would do on every file of the given globs or
+    directories. Nothing is written and the files do not need to be in a
+    git repository.
 
     HOW TO USE 
     
     ===========
 
-    1. For show the git status and git diff of the file changed
+    1. For show the diff of one file or of a whole directory
 
         $ python i18n_set_label.py showdiff path/to/file/filename.html
 
+        $ python i18n_set_label.py showdiff path/to/templates -j 4
 
-    """
-    show_diff(filename)
 
+    """
+    summaries = run_pool(partial(label_file, diff=True), expand_paths(paths), jobs)
+    for summary in summaries:
+        if summary["status"] == "error":
+            print_header(f" ERROR: {summary['filename']}: {summary['info']} ", Fore.LIGHTRED_EX)
+        elif summary["diff"]:
+            show_diff(summary["filename"], summary["diff"])
+    if any(summary["status"] == "error" for summary in summaries):
+        ctx.exit(1)
 
 
 if __name__ == '__main__':
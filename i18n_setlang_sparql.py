@@ -1,16 +1,27 @@
 import re
 import click
-from tabulate import tabulate
 from colorama import Fore, Style
 from pathlib import Path
 import textwrap
-import subprocess
-import pdb
+from bisect import bisect_right
+from collections import Counter
+from functools import partial
+from i18n_atomic import write_atomic, stage, commit_summaries
+from i18n_common import expand_paths, print_records
+from i18n_lexer import line_offsets
+from i18n_profile import phase, profiled, profile_options, run_pool
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+LANGUAGE_ORDER = ["{{ g.lang_code }}", "[AUTO_LANGUAGE]", "en"]
+FILTER_LANG = "{{ g.lang_code }}"
+FORMATS = ["table", "ndjson", "quiet"]
+LANGUAGE_PATTERN = r'(?P<language>wikibase:language[\s]+)"(?P<languages>[^"]*)"'
+FILTER_PATTERN = r"""(?i:(?P<filter>FILTER[\s]*\(LANG\(\?\w*\)[\s=]*)(?P<lang>["'][^'"]*["'])\))"""
 
 
+@profiled("render")
 def print_info(content, color, fmt):
+    from tabulate import tabulate
     print(color)
     print(tabulate(
         content,
@@ -33,57 +44,101 @@ def check_and_set_word_order(string,words):
         string_list.insert(i,word)
     return ','.join(string_list)
 
-def set_filter_lang(match,word):
-    lang = match.group(2)
-    line = match.group(1)
-    newline = re.sub(lang,f"'{word}'",line)
-    return newline
+def sparql_regex(language=True, filterlang=True):
+    patterns = [LANGUAGE_PATTERN] if language else []
+    patterns += [FILTER_PATTERN] if filterlang else []
+    return re.compile("|".join(patterns))
 
-    
 
-def replace_with_sed(filename, old, new, inplace=False, text_to_find='g.lang_code'):
-    # rx = re.compile("([\{\}\[\]])")
-    new = re.escape(new)
-    old = re.escape(old)
-    if inplace:
-        cmd =[
-            "sed",
-            "-i",
-            "-r",
-            f"s/{old}/{new}/g",
-            f"{filename}"
-        ]
-        psed = subprocess.run(cmd, stdout=subprocess.PIPE)
-        pcat = subprocess.Popen(["cat", filename], stdout=subprocess.PIPE)
-        # pdb.set_trace()
-        pgrep = subprocess.Popen(
-                ["grep", text_to_find, "-n"],
-                stdin=pcat.stdout,
-                stdout=subprocess.PIPE
-        )
-        pcat.stdout.close()
-        replacement = pgrep.communicate()[0]
+@profiled("rewrite")
+def rewrite_sparql(content, language=True, filterlang=True):
+    """
+    Apply the language order and the FILTER LANG changes in one pass.
+
+    Return the new content and one dict per match found with its kind, the
+    old and new text of the match, whether it changed and the line where it
+    starts in the new content.
+    """
+    pieces = []
+    found = []
+    last = new_offset = 0
+    for match in sparql_regex(language, filterlang).finditer(content):
+        group = match.lastgroup
+        if group == "languages":
+            kind = "language"
+            new = check_and_set_word_order(match.group(group), LANGUAGE_ORDER)
+        else:
+            kind = "filter"
+            new = f"'{FILTER_LANG}'"
+        start, end = match.span(group)
+        pieces.append(content[last:start])
+        new_offset += start - last
+        found.append({
+            "kind": kind,
+            "old": match.group(0),
+            "new": content[match.start():start] + new + content[end:match.end()],
+            "changed": new != match.group(group),
+            "offset": new_offset - (start - match.start())
+        })
+        pieces.append(new)
+        new_offset += len(new)
+        last = end
+    pieces.append(content[last:])
+    new_content = "".join(pieces)
+
+    offsets = line_offsets(new_content)
+    for match in found:
+        match["line"] = bisect_right(offsets, match.pop("offset"))
+    return new_content, found
+
+
+def changed_lines(content, found):
+    offsets = line_offsets(content) + [len(content) + 1]
+    lines = sorted({match["line"] for match in found if match["changed"]})
+    return [
+        f"{line}:{content[offsets[line - 1]:offsets[line] - 1]}"
+        for line in lines
+    ]
 
-    else:
-        cmd =[
-            "sed",
-            "-r",
-            f"s/{old}/{new}/g",
-            f"{filename}"
-        ]
 
-        psed = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        pgrep = subprocess.Popen(
-                ["grep", text_to_find, "-n"],
-                stdin=psed.stdout,
-                stdout=subprocess.PIPE
-        )
-        psed.stdout.close()
-        replacement = pgrep.communicate()[0]
-    return replacement
+@profiled("read", 0)
+def read_file(filename):
+    with open(filename, "r", newline="") as fstream:
+        content = fstream.read()
+    return content
+
+
+@profiled("write", 0)
+def write_file(filename, content):
+    return write_atomic(filename, content)
+
+
+def rewrite_file(filename, inplace=False):
+    """
+    Apply both rewrites to filename and return a summary of the result.
+    With inplace, the new content is only staged (see i18n_atomic.stage)
+    in summary["staged"], for the batch to commit all the files at once,
+    and a file that cannot be read or written gets the status 'error'.
+    """
+    summary = {"filename": filename, "status": "unchanged", "lines": [], "info": "", "written": False}
+    try:
+        content = read_file(filename)
+        new_content, found = rewrite_sparql(content)
+        if not found:
+            summary["info"] = "no language option nor FILTER LANG"
+        if new_content != content:
+            summary["status"] = "changed"
+            summary["lines"] = changed_lines(new_content, found)
+            if inplace:
+                with phase("write", filename):
+                    summary["staged"] = stage(filename, new_content)
+    except Exception as error:
+        summary.update({"status": "error", "info": f"{type(error).__name__}: {error}"})
+    return summary
 
 
 @click.group(context_settings=CONTEXT_SETTINGS)
+@profile_options
 def cli():
     pass
 
@@ -91,34 +146,26 @@ def cli():
 @cli.command()
 @click.argument('filename')
 @click.option('--inplace',"-i",is_flag=True)
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as a table, one json object per match, or nothing")
 def findreplace(**kwargs):
     filename = kwargs["filename"]
 
-    process = subprocess.run(['cat',filename],stdout=subprocess.PIPE)
-    re_obj = re.compile(r'(wikibase:language[\s]+)("([^"]*)")')
-    matches = re_obj.search(process.stdout.decode('utf-8'))
-    # pdb.set_trace()
-    if matches:
-        languages = matches.group(3)
-        newlang = languages
-        newlang = check_and_set_word_order(languages, [
-            "{{ g.lang_code }}",
-            "[AUTO_LANGUAGE]",
-            "en"
-        ])
-        
+    content = read_file(filename)
+    new_content, found = rewrite_sparql(content, filterlang=False)
 
-        if newlang != languages:
-            
-            if "," not in languages:
-                languages = f'{matches.group(1)}{matches.group(2)}'
-                newlang=f'{matches.group(1)}"{newlang}"'
-            
-            replacement=replace_with_sed(filename, languages, newlang, inplace=kwargs["inplace"])
+    if kwargs["fmt"] != "table":
+        if kwargs["inplace"] and new_content != content:
+            write_file(filename, new_content)
+        if kwargs["fmt"] == "ndjson":
+            print_records({"file": filename, **match} for match in found)
+    elif found:
+        if new_content != content:
+            if kwargs["inplace"]:
+                write_file(filename, new_content)
             print_info({
                 "Filename": [Path(filename).name], 
                 "Text that will be replaced\n( nline: newtext )": [
-                    textwrap.fill(replacement.decode('utf-8'), width=50)
+                    textwrap.fill("\n".join(changed_lines(new_content, found)), width=50)
                 ]
             }, Fore.LIGHTGREEN_EX, "psql")
         else:
@@ -132,34 +179,30 @@ def findreplace(**kwargs):
 @cli.command()
 @click.argument('filename')
 @click.option('--inplace',"-i",is_flag=True)
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as a table, one json object per match, or nothing")
 def filterlang(**kwargs):
     filename = kwargs["filename"]
 
-    process = subprocess.run(['cat',filename],stdout=subprocess.PIPE)
-    re_obj = re.compile(r"(FILTER[\s]*\(LANG\(\?\w*\)[\s=]*([\"']([^'\"]*)[\"'])\))",re.I|re.M)
-    are_there_matches = re_obj.search(process.stdout.decode('utf-8'))
-    # pdb.set_trace()
-    if are_there_matches:
-        matches = re_obj.finditer(process.stdout.decode('utf-8'))
-        message = []
-        for match in matches:
-            oldline = match.group(1)
-            newline = set_filter_lang(match, "{{ g.lang_code }}")
-
-            if newline != oldline:
-                replacement=replace_with_sed(
-                    filename,oldline, newline,
-                    inplace=kwargs["inplace"],
-                    text_to_find="FILTER.*g.lang_code"
-                )
-                message.append('\n'.join(line.strip() for line in re.findall(r'.{1,90}(?:\s+|$)', replacement.decode('utf-8'))))
-                
-            else:
+    content = read_file(filename)
+    new_content, found = rewrite_sparql(content, language=False)
+
+    if kwargs["fmt"] != "table":
+        if kwargs["inplace"] and new_content != content:
+            write_file(filename, new_content)
+        if kwargs["fmt"] == "ndjson":
+            print_records({"file": filename, **match} for match in found)
+    elif found:
+        for match in found:
+            if not match["changed"]:
                 print_info({"INFO: " : [f"File: {Path(filename).name} - Nothing to change"]}, Fore.LIGHTRED_EX, "plain") 
-        
-        if kwargs["inplace"]:
-            message =  [message[-1]] if message else ""
 
+        if kwargs["inplace"] and new_content != content:
+            write_file(filename, new_content)
+
+        message = [
+            '\n'.join(line.strip() for line in re.findall(r'.{1,90}(?:\s+|$)', line))
+            for line in changed_lines(new_content, found)
+        ]
         print_info({
                     "Filename": [Path(filename).name], 
                     "Text that will be replaced\n( nline: newtext )": message
@@ -172,6 +215,60 @@ def filterlang(**kwargs):
             Fore.LIGHTYELLOW_EX, "plain")
 
 
+@cli.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--inplace',"-i",is_flag=True)
+@click.option('--jobs', '-j', type=int, default=None, help="number of worker processes (default: number of cores)")
+@click.option('--suffix', default=".sparql", show_default=True, help="suffix of the files searched in directories")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default="table", help="report as tables, one json object per file, or nothing")
+@click.pass_context
+def batch(ctx, **kwargs):
+    """
+    To run findreplace and filterlang on several files at once
+
+    Every file found in the given globs or directories is read once, both
+    the language order and the FILTER LANG rewrites are applied to it, and
+    the files are spread across a pool of worker processes. One report
+    shows the lines changed in every file.
+
+    HOW TO USE
+
+    ===========
+
+        $ python i18n_setlang_sparql.py batch path/to/queries "other/*.sparql" -i
+
+    """
+    files = expand_paths(kwargs["paths"], kwargs["suffix"])
+    summaries = run_pool(
+        partial(rewrite_file, inplace=kwargs["inplace"]), files, kwargs["jobs"]
+    )
+    written = commit_summaries(summaries)
+
+    totals = Counter(summary["status"] for summary in summaries)
+    if kwargs["fmt"] == "ndjson":
+        print_records(summaries)
+    elif kwargs["fmt"] == "table":
+        print_info({
+                "Filename": [summary["filename"] for summary in summaries],
+                "Status": [summary["status"] for summary in summaries],
+                "Changed lines\n( nline: newtext )": [
+                    "\n".join(textwrap.fill(line, width=90) for line in summary["lines"])
+                    or summary["info"]
+                    for summary in summaries
+                ]
+            }, Fore.LIGHTGREEN_EX, "psql")
+
+        print_info({
+            "INFO: ": [
+                f"{len(files)} files: {totals['changed']} changed, "
+                f"{totals['unchanged']} unchanged, {totals['error']} errors"
+                + (f"; {written} written, {len(files) - written - totals['error']} "
+                   f"skipped as unchanged" if kwargs["inplace"] else "")
+            ]
+        }, Fore.LIGHTCYAN_EX, "plain")
+    if totals["error"]:
+        ctx.exit(1)
+
 
 if __name__ == '__main__':
     cli()
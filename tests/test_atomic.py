@@ -0,0 +1,34 @@
+from i18n_atomic import unchanged, write_atomic
+
+
+def test_crlf_file_with_same_content_is_not_written(tmp_path):
+    page = tmp_path / "page.html"
+    page.write_bytes(b"<h2>Title</h2>\r\n<p>Text</p>\r\n")
+    mtime = page.stat().st_mtime_ns
+
+    assert unchanged(page, "<h2>Title</h2>\r\n<p>Text</p>\r\n")
+    assert not write_atomic(page, "<h2>Title</h2>\r\n<p>Text</p>\r\n")
+    assert page.stat().st_mtime_ns == mtime
+
+
+def test_written_bytes_keep_line_endings(tmp_path):
+    page = tmp_path / "page.html"
+    page.write_bytes(b"<h2>Title</h2>\r\n")
+
+    assert write_atomic(page, "<h2 data-i18n=\"title\">Title</h2>\r\n")
+    assert page.read_bytes() == b"<h2 data-i18n=\"title\">Title</h2>\r\n"
+    assert unchanged(page, "<h2 data-i18n=\"title\">Title</h2>\r\n")
+    assert not unchanged(page, "<h2 data-i18n=\"title\">Title</h2>\n")
+
+
+def test_symlink_is_kept_and_its_target_written(tmp_path):
+    target = tmp_path / "real" / "page.html"
+    target.parent.mkdir()
+    target.write_text("<h2>Title</h2>\n")
+    link = tmp_path / "page.html"
+    link.symlink_to(target)
+
+    assert write_atomic(link, "<h2 data-i18n=\"page-title\">Title</h2>\n")
+    assert link.is_symlink()
+    assert target.read_text() == "<h2 data-i18n=\"page-title\">Title</h2>\n"
+    assert [path.name for path in target.parent.iterdir()] == ["page.html"]
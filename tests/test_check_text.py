@@ -0,0 +1,24 @@
+import json
+from click.testing import CliRunner
+from i18n_check_text import cli
+
+
+def records(filename, *options):
+    result = CliRunner().invoke(
+        cli, ["show", str(filename), "--showcontext", "--format", "ndjson", *options]
+    )
+    assert result.exit_code == 0, result.output
+    return [json.loads(line) for line in result.output.splitlines()]
+
+
+def test_chunked_context_matches_full_read(tmp_path):
+    template = tmp_path / "page.html"
+    template.write_text("".join(
+        f"<p>\n\nUntranslated text {i}</p>\n" for i in range(3000)
+    ))
+
+    full = records(template)
+    assert len(full) == 3000
+    assert all(record["context"] for record in full)
+    assert records(template, "--chunked") == full
+    assert records(template, "--chunked", "--chunk-size", "7") == full
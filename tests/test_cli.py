@@ -0,0 +1,11 @@
+from click.testing import CliRunner
+from i18n_cli import cli
+
+
+def test_run_goes_on_after_a_command_raising(tmp_path):
+    result = CliRunner().invoke(
+        cli, ["run", f"check-text show {tmp_path / 'missing.html'}", "sparql --help"]
+    )
+    assert result.exit_code == 1
+    assert "FileNotFoundError" in result.stderr
+    assert "findreplace" in result.stdout
@@ -0,0 +1,57 @@
+import json
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+from i18n_create_json import merge_keys, merge_locale, read_json, save_locale, write_json
+
+KEYS = ["d-new", "b-old", "a-new", "z-null", "b-old"]
+
+
+def load_and_sort(outfile, keys):
+    """What save_locale does when the file cannot be merged as a stream"""
+    content = read_json(outfile) if outfile.exists() else {}
+    metadata = {"@metadata": content.pop("@metadata", None)}
+    merge_keys(outfile, keys, content)
+    write_json(outfile, {**metadata, **OrderedDict(sorted(content.items()))})
+
+
+def both_ways(tmp_path, data):
+    streamed, loaded = tmp_path / "streamed.json", tmp_path / "loaded.json"
+    if data is not None:
+        streamed.write_text(json.dumps(data, indent=4))
+        shutil.copy(streamed, loaded)
+    existing, _ = merge_locale(streamed, KEYS)
+    load_and_sort(loaded, KEYS)
+    return existing, streamed.read_bytes(), loaded.read_bytes()
+
+
+@pytest.mark.parametrize("data", [
+    {"@metadata": {"authors": ["someone"]}, "b-old": "B", "c-old": "C", "z-null": None},
+    {"b-old": "B", "c-old": ""},
+    {"@metadata": None, "b-old": {"nested": [1, {"deep": "élan"}], "n": 1.5}, "e": [True, None]},
+    {},
+    None,
+], ids=["metadata", "no-metadata", "nested", "empty", "new-file"])
+def test_merge_locale_writes_the_bytes_of_load_and_sort(tmp_path, data):
+    existing, streamed, loaded = both_ways(tmp_path, data)
+    assert streamed == loaded
+    assert existing == [key for key in (data or {}) if key != "@metadata"]
+
+
+def test_merge_locale_leaves_an_unsorted_file_to_load_and_sort(tmp_path):
+    outfile = tmp_path / "en.json"
+    content = json.dumps({"c-old": "C", "@metadata": None, "b-old": "B"}, indent=4)
+    outfile.write_text(content)
+
+    assert merge_locale(outfile, KEYS) == (None, False)
+    assert outfile.read_text() == content
+
+    expected = tmp_path / "expected.json"
+    shutil.copy(outfile, expected)
+    load_and_sort(expected, KEYS)
+    kwargs = {"format": "quiet", "verbose": False, "inplace": True, "output": "en.json"}
+    assert save_locale(outfile, ["page.html"], [KEYS], kwargs)
+    assert outfile.read_bytes() == Path(expected).read_bytes()
+    assert list(json.loads(outfile.read_text()))[:2] == ["@metadata", "a-new"]
@@ -0,0 +1,30 @@
+import os
+from i18n_create_json import extract_all_keys
+
+TEMPLATE = """<p data-i18n="a&amp;b">x</p>
+<!-- <p data-i18n="commented-out">x</p> -->
+<script>var s = '<p data-i18n="in-script">';</script>
+<p data-i18n='single-quoted'>y</p>
+"""
+
+
+def test_index_gives_the_keys_of_the_backend(tmp_path):
+    template = tmp_path / "page.html"
+    template.write_text(TEMPLATE)
+    index = str(tmp_path / "index.sqlite")
+
+    for backend in ("stream", "bs4", "lexer"):
+        without = extract_all_keys([str(template)], jobs=1, backend=backend)
+        assert extract_all_keys([str(template)], jobs=1, backend=backend, index=index) == without
+        assert extract_all_keys([str(template)], jobs=1, backend=backend, index=index) == without
+
+
+def test_index_extracts_again_a_changed_file(tmp_path):
+    template = tmp_path / "page.html"
+    template.write_text('<p data-i18n="old">x</p>\n')
+    index = str(tmp_path / "index.sqlite")
+    assert extract_all_keys([str(template)], jobs=1, index=index) == [["old"]]
+
+    template.write_text('<p data-i18n="new">x</p>\n')
+    os.utime(template, ns=(1, 1))
+    assert extract_all_keys([str(template)], jobs=1, index=index) == [["new"]]
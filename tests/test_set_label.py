@@ -0,0 +1,45 @@
+from i18n_set_label import label_content
+
+
+def test_self_closing_header_gets_the_attribute_before_the_slash():
+    content = '<h2 id="intro-header"/>\n<h3 id="more" />\n'
+    *_, new_content = label_content("page.html", content)
+    assert new_content == (
+        '<h2 id="intro-header" data-i18n="page-intro"/>\n'
+        '<h3 id="more" data-i18n="page-more" />\n'
+    )
+
+
+def test_header_without_text_nor_id_is_not_labelled():
+    content = "<h2></h2>\n<h3/>\n<h4>Title</h4>\n"
+    *_, changes, new_content = label_content("page.html", content)
+    assert new_content == '<h2></h2>\n<h3/>\n<h4 data-i18n="page-title">Title</h4>\n'
+    assert [change["info"] for change in changes].count("Change") == 1
+
+
+def test_header_with_jinja_is_not_labelled():
+    content = '<h2>{{ _("Intro") }}</h2>\n<h3>Hello {{ name }}</h3>\n'
+    *_, changes, new_content = label_content("page.html", content)
+    assert new_content == content
+    assert [change["info"] for change in changes] == ["No text nor id to make the key"] * 2
+
+
+def test_header_with_quote_is_not_labelled():
+    content = '<h2>Say "hi"</h2>\n<h3 id="say-&quot;hi&quot;">x</h3>\n'
+    *_, changes, new_content = label_content("page.html", content)
+    assert new_content == content
+    assert [change["info"] for change in changes] == ["The key would have a '\"'"] * 2
+
+
+def test_repeated_headers_are_numbered():
+    content = (
+        "<h2>Same</h2>\n<h3>Other</h3>\n<h3>Same</h3>\n"
+        '<h4 data-i18n="page-same">Old</h4>\n'
+    )
+    *_, new_content = label_content("page.html", content)
+    assert new_content == (
+        '<h2 data-i18n="page-same-w0">Same</h2>\n'
+        '<h3 data-i18n="page-other">Other</h3>\n'
+        '<h3 data-i18n="page-same-w1">Same</h3>\n'
+        '<h4 data-i18n="page-same-w2">Old</h4>\n'
+    )